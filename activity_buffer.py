@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import logging
+import threading
+from datetime import datetime
+
+from activity_log import get_activity_log
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для ключей config.json
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_FLUSH_SIZE = 200
+
+class ActivityBuffer:
+    """
+    Буфер активности пользователей (write-behind).
+    События копятся в памяти и записываются в журнал действий, а счетчики
+    профилей обновляются одной транзакцией - по таймеру, при накоплении
+    flush_size событий и при завершении работы.
+    """
+
+    def __init__(self, flush_size=DEFAULT_FLUSH_SIZE, on_full=None):
+        self.flush_size = max(1, int(flush_size))
+        # Вызывается вместо немедленной записи, когда буфер заполнен (например, запуск flush в пуле потоков)
+        self.on_full = on_full
+        self.pending = {}  # {user_id: {'username', 'last_seen', 'chat_id', 'actions'}}
+        self.events = 0
+        self.flush_requested = False
+        self.lock = threading.Lock()
+        # Одновременно идет только одна запись, чтобы порядок действий сохранялся
+        self.flush_lock = threading.Lock()
+
+    def record(self, user_id, username, action, chat_id=None):
+        """Добавляет событие; при переполнении буфера записывает его (или передает on_full)"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            entry = self.pending.setdefault(user_id, {'chat_id': None, 'actions': []})
+            entry['username'] = username
+            entry['last_seen'] = now
+            if chat_id is not None:
+                entry['chat_id'] = chat_id
+            entry['actions'].append({
+                'time': now,
+                'action': action,
+                'chat_id': chat_id,  # Сохраняем chat_id для каждого действия
+                'user_id': user_id   # И user_id для дублирования
+            })
+            self.events += 1
+            full = self.events >= self.flush_size and not self.flush_requested
+            if full:
+                self.flush_requested = True
+        if full:
+            if self.on_full:
+                self.on_full()
+            else:
+                self.flush()
+
+    def flush(self):
+        """Записывает накопленные события; при ошибке возвращает их в буфер. Возвращает число событий"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                events, self.events = self.events, 0
+                self.flush_requested = False
+            if not pending:
+                return 0
+
+            try:
+                get_activity_log().write(
+                    {user_id: self._applier(user_id, entry) for user_id, entry in pending.items()},
+                    [(user_id, action) for user_id, entry in pending.items() for action in entry['actions']]
+                )
+            except Exception as e:
+                logger.error(f"Ошибка записи активности пользователей ({events} событий): {e}")
+                self._restore(pending, events)
+                return 0
+            return events
+
+    @staticmethod
+    def _applier(user_id, entry):
+        def apply(user_data):
+            user_data['username'] = entry['username']
+            user_data['last_seen'] = entry['last_seen']
+            if entry['chat_id'] is not None:
+                user_data['chat_id'] = entry['chat_id']
+            user_data['user_id'] = user_id
+            user_data['total_actions'] = user_data.get('total_actions', 0) + len(entry['actions'])
+            user_data['last_action'] = entry['actions'][-1]['action']
+        return apply
+
+    def _restore(self, pending, events):
+        """Возвращает незаписанные события в начало буфера"""
+        with self.lock:
+            for user_id, entry in pending.items():
+                newer = self.pending.get(user_id)
+                if newer:
+                    entry['actions'].extend(newer['actions'])
+                    entry['username'] = newer['username']
+                    entry['last_seen'] = newer['last_seen']
+                    if newer['chat_id'] is not None:
+                        entry['chat_id'] = newer['chat_id']
+                self.pending[user_id] = entry
+            self.events += events
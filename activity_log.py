@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import logging
+import threading
+
+from user_repository import USERS_DIR, get_connection, modify_many_user_data
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_DIR = os.path.join(USERS_DIR, 'activity')
+SEGMENT_RE = re.compile(r'^segment_(\d{6})\.jsonl$')
+# Значение по умолчанию для ключа activity_segment_size в config.json
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+DEFAULT_ACTIONS_LIMIT = 500
+MIGRATION_BATCH = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions_index (
+    user_id TEXT NOT NULL,
+    time TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_actions_user_time ON actions_index(user_id, time);
+"""
+
+class ActivityLog:
+    """
+    Журнал действий пользователей.
+    Действия дописываются строками JSON в файлы-сегменты segment_NNNNNN.jsonl,
+    новый сегмент начинается, когда текущий превышает segment_size.
+    Таблица actions_index в базе пользователей хранит для каждого действия
+    пользователя, время и место строки в сегменте, а в профиле остаются только счетчики.
+    """
+
+    def __init__(self, base_dir=ACTIVITY_DIR, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.base_dir = base_dir
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+        get_connection().executescript(SCHEMA)
+
+    def _segment_path(self, number):
+        return os.path.join(self.base_dir, f"segment_{number:06d}.jsonl")
+
+    def _current_segment(self):
+        """Номер сегмента для записи; заполненный сегмент больше не дописывается"""
+        numbers = [int(match.group(1)) for match in map(SEGMENT_RE.match, os.listdir(self.base_dir)) if match]
+        number = max(numbers) if numbers else 1
+        path = self._segment_path(number)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            number += 1
+        return number
+
+    def _append(self, actions):
+        """Дописывает действия [(user_id, действие)] в сегмент и возвращает строки индекса"""
+        rows = []
+        number = self._current_segment()
+        with open(self._segment_path(number), 'ab') as f:
+            offset = f.tell()
+            for user_id, action in actions:
+                line = (json.dumps(action, ensure_ascii=False) + '\n').encode('utf-8')
+                f.write(line)
+                rows.append((str(user_id), action.get('time', ''), number, offset, len(line)))
+                offset += len(line)
+        return rows
+
+    def write(self, mutations, actions):
+        """
+        Записывает действия [(user_id, действие)] в журнал и одной транзакцией
+        добавляет их в индекс и применяет изменения профилей {user_id: mutate}.
+        """
+        with self.lock:
+            rows = self._append(actions) if actions else []
+
+            def add_index(connection):
+                connection.executemany(
+                    "INSERT INTO actions_index (user_id, time, segment, position, length) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+            # Строки без записи в индексе при сбое просто не будут найдены
+            modify_many_user_data(mutations, within_transaction=add_index)
+
+    def read(self, user_id, since=None, until=None, limit=DEFAULT_ACTIONS_LIMIT):
+        """
+        Последние limit действий пользователя в интервале [since, until] по возрастанию времени.
+        Возвращает (действия, есть_еще_более_ранние).
+        """
+        conditions = ["user_id = ?"]
+        params = [str(user_id)]
+        if since:
+            conditions.append("time >= ?")
+            params.append(since)
+        if until:
+            conditions.append("time <= ?")
+            params.append(until)
+        rows = get_connection().execute(
+            "SELECT segment, position, length FROM actions_index WHERE " + " AND ".join(conditions) +
+            " ORDER BY time DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+        actions = []
+        files = {}
+        try:
+            for segment, position, length in rows:
+                if segment not in files:
+                    files[segment] = open(self._segment_path(segment), 'rb')
+                f = files[segment]
+                f.seek(position)
+                try:
+                    actions.append(json.loads(f.read(length).decode('utf-8')))
+                except ValueError:
+                    logger.error(f"Поврежденная запись журнала действий: сегмент {segment}, смещение {position}")
+        finally:
+            for f in files.values():
+                f.close()
+        return actions, has_more
+
+    def migrate_profiles(self):
+        """
+        Переносит массивы actions из профилей в журнал, оставляя в профиле счетчик total_actions.
+        Обрабатывает пользователей пачками. Возвращает число перенесенных действий.
+        """
+        connection = get_connection()
+        moved = 0
+        while True:
+            batch = connection.execute(
+                "SELECT user_id, data FROM users WHERE json_type(data, '$.actions') IS NOT NULL LIMIT ?",
+                (MIGRATION_BATCH,)
+            ).fetchall()
+            if not batch:
+                break
+
+            mutations = {}
+            actions = []
+            for user_id, data in batch:
+                user_actions = json.loads(data).get('actions') or []
+                actions.extend((user_id, action) for action in user_actions)
+                mutations[user_id] = _migrate_profile(len(user_actions))
+            self.write(mutations, actions)
+            moved += len(actions)
+
+        if moved:
+            logger.info(f"Перенесено действий пользователей в журнал: {moved}")
+        return moved
+
+def _migrate_profile(count):
+    def migrate(user_data):
+        user_data.pop('actions', None)
+        user_data['total_actions'] = user_data.get('total_actions', 0) + count
+    return migrate
+
+_activity_log = None
+_activity_log_lock = threading.Lock()
+
+def get_activity_log(config=None, migrate=True):
+    """
+    Общий журнал действий процесса.
+    В журнал пишет только бот, поэтому перенос старых массивов actions
+    при первом обращении выполняется им, а админ-панель передает migrate=False.
+    """
+    global _activity_log
+    with _activity_log_lock:
+        if _activity_log is None:
+            segment_size = (config or {}).get('activity_segment_size', DEFAULT_SEGMENT_SIZE)
+            _activity_log = ActivityLog(segment_size=segment_size)
+            if migrate:
+                _activity_log.migrate_profiles()
+        return _activity_log
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != 'migrate':
+        print("Использование: python activity_log.py migrate")
+        sys.exit(1)
+    print(f"Перенесено действий: {ActivityLog().migrate_profiles()}")
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
 from telegram import Bot
 import json
 import os
@@ -8,13 +8,21 @@ import subprocess
 import sys
 import psutil
 import time
-import glob
 import threading
-import requests
 from datetime import datetime
+from collections import OrderedDict
 from urllib.parse import quote_plus
 import asyncio
 from bot import send_ban_notification as send_bot_notification
+from sources import get_sources, source_dir
+from schedule_store import ScheduleStore, VERSION_SUFFIX
+from schedule_diff import diff_schedules, changed_dates
+from parser import get_schedule_hash
+from user_repository import iter_users, load_user_data, modify_user_data
+from activity_log import DEFAULT_ACTIONS_LIMIT, get_activity_log
+from outbound_limiter import MAX_SEND_ATTEMPTS, get_outbound_limiter
+from broadcasts import DEFAULT_BROADCAST_CONCURRENCY, get_broadcast, start_broadcast
+from telegram_api import get_telegram_client
 
 app = Flask(__name__, template_folder='templates')
 app.secret_key = 'your-secret-key-here'
@@ -30,6 +38,14 @@ MESSAGES_DIR = 'messages'
 INDIVIDUAL_MSGS_FILE = os.path.join(MESSAGES_DIR, 'individual_messages.json')
 GROUP_MSGS_FILE = os.path.join(MESSAGES_DIR, 'group_messages.json')
 BROADCAST_MSGS_FILE = os.path.join(MESSAGES_DIR, 'broadcast_messages.json')
+SCHEDULES_PER_PAGE = 50
+DIFF_CACHE_SIZE = 64
+BROADCAST_STATUS_HEARTBEAT = 15
+
+# Разницы между версиями: {(хеш_a, хеш_b): разница}
+diff_cache = OrderedDict()
+# Файлы истории сообщений переписываются целиком, поэтому запись - по очереди
+history_lock = threading.Lock()
 
 def init_message_files():
     """Инициализация файлов сообщений при запуске"""
@@ -56,7 +72,8 @@ def init_data_structure():
             'site_url': 'SITE',
             'admin_login': 'admin',
             'admin_password': 'admin',
-            'check_interval': 1800
+            'check_interval': 1800,
+            'parser_engine': 'bs4'
         }
         with open(CONFIG_FILE, 'w') as f:
             json.dump(default_config, f, indent=4)
@@ -173,20 +190,6 @@ def bot_status():
         print(f"Ошибка проверки статуса бота: {e}")
         return "stopped"
 
-def load_user_data(user_id):
-    """Загружает данные пользователя"""
-    user_file = os.path.join(USERS_DIR, f"{user_id}.json")
-    if os.path.exists(user_file):
-        with open(user_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return None
-
-def save_user_data(user_id, data):
-    """Сохраняет данные пользователя"""
-    user_file = os.path.join(USERS_DIR, f"{user_id}.json")
-    with open(user_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
 def send_ban_notification(user_id, reason, is_banned=True):
     """Отправляет уведомление о блокировке или разблокировке"""
     try:
@@ -211,19 +214,11 @@ def send_ban_notification(user_id, reason, is_banned=True):
         else:
             message = "✅ Ваша блокировка в боте снята!"
 
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        response = requests.post(
-            url,
-            json={
-                'chat_id': chat_id,
-                'text': message
-            }
-        )
-        
-        if response.status_code == 200:
+        result = _send_telegram_message(token, chat_id, message, user_id)
+        if result['success']:
             print(f"Уведомление отправлено пользователю {user_id}.")
         else:
-            print(f"Ошибка отправки уведомления: {response.json()}")
+            print(f"Ошибка отправки уведомления: {result['error']}")
     except Exception as e:
         print(f"Ошибка отправки уведомления: {e}")
 
@@ -296,19 +291,27 @@ def update_config():
             flash('Некорректное значение интервала проверки. Используется значение по умолчанию (1800 сек)', 'warning')
             check_interval = 1800
 
-        new_config = {
+        parser_engine = request.form.get('parser_engine', 'bs4')
+        if parser_engine not in ('bs4', 'lxml'):
+            parser_engine = 'bs4'
+
+        old_config = load_config()
+
+        # Ключи, которых нет в форме, переносим из старого конфига
+        new_config = dict(old_config)
+        new_config.update({
             'token': request.form.get('token', '').strip(),
             'site_url': request.form.get('site_url', '').strip(),
             'admin_login': request.form.get('admin_login', '').strip(),
             'admin_password': request.form.get('admin_password', '').strip(),
-            'check_interval': check_interval
-        }
+            'check_interval': check_interval,
+            'parser_engine': parser_engine
+        })
 
         if not all([new_config['site_url'], new_config['admin_login'], new_config['admin_password']]):
             flash('Все поля обязательны для заполнения', 'danger')
             return redirect(url_for('admin'))
 
-        old_config = load_config()
         token_changed = old_config.get('token') != new_config['token']
 
         if save_config(new_config):
@@ -427,23 +430,25 @@ def get_users():
     
     try:
         users = {}
-        for filename in os.listdir(USERS_DIR):
-            if filename.endswith('.json'):
-                user_id = filename[:-5]
-                with open(os.path.join(USERS_DIR, filename), 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-                    if 'chat_id' not in user_data:
-                        user_data['chat_id'] = None
-                    # Добавляем количество действий
-                    user_data['total_actions'] = len(user_data.get('actions', []))
-                    users[user_id] = user_data
+        for user_id, user_data in iter_users():
+            if 'chat_id' not in user_data:
+                user_data['chat_id'] = None
+            # Действия лежат в журнале, в профиле только счетчик
+            # (массив actions есть только у еще не перенесенных профилей)
+            if 'total_actions' not in user_data:
+                user_data['total_actions'] = len(user_data.get('actions', []))
+            user_data.pop('actions', None)
+            users[user_id] = user_data
         return jsonify(users)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_user_actions/<user_id>')
 def get_user_actions(user_id):
-    """Получение действий конкретного пользователя"""
+    """
+    Действия пользователя из журнала.
+    Параметры: since и until (ISO-время или дата), limit - сколько последних действий вернуть.
+    """
     if not session.get('logged_in'):
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -452,10 +457,27 @@ def get_user_actions(user_id):
         if not user_data:
             return jsonify({'error': 'Пользователь не найден'}), 404
         
+        since = request.args.get('since') or None
+        until = request.args.get('until') or None
+        if until and len(until) == 10:
+            until += 'T23:59:59.999999'  # дата без времени - включительно весь день
+        limit = min(max(1, request.args.get('limit', DEFAULT_ACTIONS_LIMIT, type=int)), 5000)
+        
+        if 'actions' in user_data:
+            # Профиль еще не перенесен ботом в журнал
+            actions = [action for action in user_data['actions']
+                       if (not since or action.get('time', '') >= since)
+                       and (not until or action.get('time', '') <= until)]
+            has_more = len(actions) > limit
+            actions = actions[-limit:]
+        else:
+            actions, has_more = get_activity_log(migrate=False).read(user_id, since, until, limit)
+        
         return jsonify({
             'username': user_data.get('username'),
-            'total_actions': len(user_data.get('actions', [])),
-            'actions': user_data.get('actions', [])
+            'total_actions': user_data.get('total_actions', len(user_data.get('actions', []))),
+            'actions': actions,
+            'has_more': has_more
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -531,13 +553,12 @@ def ban_user():
     reason = request.form.get('reason', 'Нарушение правил')
 
     try:
-        user_data = load_user_data(user_id)
-        if not user_data:
-            return jsonify({'error': 'Пользователь не найден'}), 404
+        def ban(user_data):
+            user_data['banned'] = True
+            user_data['ban_reason'] = reason
         
-        user_data['banned'] = True
-        user_data['ban_reason'] = reason
-        save_user_data(user_id, user_data)
+        if not modify_user_data(user_id, ban, create=False):
+            return jsonify({'error': 'Пользователь не найден'}), 404
 
         send_ban_notification(user_id, reason, is_banned=True)
         return jsonify({'message': f'Пользователь {user_id} заблокирован'})
@@ -553,14 +574,13 @@ def unban_user():
     user_id = request.form.get('user_id')
 
     try:
-        user_data = load_user_data(user_id)
-        if not user_data:
-            return jsonify({'error': 'Пользователь не найден'}), 404
+        def unban(user_data):
+            user_data['banned'] = False
+            if 'ban_reason' in user_data:
+                del user_data['ban_reason']
         
-        user_data['banned'] = False
-        if 'ban_reason' in user_data:
-            del user_data['ban_reason']
-        save_user_data(user_id, user_data)
+        if not modify_user_data(user_id, unban, create=False):
+            return jsonify({'error': 'Пользователь не найден'}), 404
 
         send_ban_notification(user_id, "", is_banned=False)
         return jsonify({'message': f'Пользователь {user_id} разблокирован'})
@@ -569,7 +589,10 @@ def unban_user():
 
 @app.route('/send_message', methods=['POST'])
 def send_message():
-    """Универсальный обработчик отправки сообщений"""
+    """
+    Универсальный обработчик отправки сообщений.
+    Рассылка выполняется в фоне; ответ содержит job_id для /broadcast_status/<job_id>.
+    """
     if not session.get('logged_in'):
         return jsonify({'error': 'Unauthorized'}), 401
 
@@ -581,6 +604,8 @@ def send_message():
 
         if not message:
             return jsonify({'error': 'Message text cannot be empty'}), 400
+        if message_type not in ('broadcast', 'group', 'individual'):
+            return jsonify({'error': 'Invalid message type'}), 400
 
         config = load_config()
         if not config or not config.get('token'):
@@ -597,86 +622,83 @@ def send_message():
         }
 
         token = config['token']
-        success_count = 0
-        failed_count = 0
-        recipients = []
-
-        # Обработка разных типов сообщений
-        if message_type == 'broadcast':
-            # Всем пользователям
-            for filename in os.listdir(USERS_DIR):
-                if filename.endswith('.json'):
-                    with open(os.path.join(USERS_DIR, filename), 'r', encoding='utf-8') as f:
-                        user_data = json.load(f)
-                        if not user_data.get('banned', False) and user_data.get('chat_id'):
-                            recipients.append({
-                                'user_id': user_data.get('user_id'),
-                                'chat_id': user_data['chat_id']
-                            })
-        else:
-            # Конкретным пользователям
-            for user_id in user_ids:
-                user_data = load_user_data(user_id)
-                if user_data and user_data.get('chat_id') and not user_data.get('banned', False):
-                    recipients.append({
-                        'user_id': user_id,
-                        'chat_id': user_data['chat_id']
-                    })
-                else:
-                    failed_count += 1
-                    msg_data['delivered'].append({
-                        'user_id': user_id,
-                        'status': 'failed',
-                        'reason': 'User not found or banned'
-                    })
-
-        # Отправка сообщений
-        for recipient in recipients:
-            try:
-                url = f"https://api.telegram.org/bot{token}/sendMessage"
-                response = requests.post(url, json={
-                    'chat_id': recipient['chat_id'],
-                    'text': message
-                }, timeout=10)
-
-                if response.json().get('ok'):
-                    success_count += 1
-                    msg_data['delivered'].append({
-                        'user_id': recipient['user_id'],
-                        'chat_id': recipient['chat_id'],
-                        'status': 'success'
-                    })
-                else:
-                    failed_count += 1
-                    error = response.json().get('description', 'Unknown error')
-                    msg_data['delivered'].append({
-                        'user_id': recipient['user_id'],
-                        'chat_id': recipient['chat_id'],
-                        'status': 'failed',
-                        'reason': error
-                    })
-            except Exception as e:
-                failed_count += 1
-                msg_data['delivered'].append({
-                    'user_id': recipient.get('user_id'),
-                    'status': 'failed',
-                    'reason': str(e)
-                })
-
-        # Сохраняем в историю
-        _save_message_to_history(message_type, msg_data)
+        job = start_broadcast(
+            message_type,
+            msg_data,
+            collect=lambda: _collect_recipients(message_type, user_ids),
+            send=lambda chat_id, text, user_id: _send_telegram_message(token, chat_id, text, user_id),
+            save_history=_save_message_to_history,
+            concurrency=config.get('broadcast_concurrency', DEFAULT_BROADCAST_CONCURRENCY)
+        )
 
         return jsonify({
-            'message': f'Успешно отправлено: {success_count}, Ошибок: {failed_count}',
-            'details': msg_data
+            'message': 'Рассылка запущена',
+            'job_id': job.job_id,
+            'status_url': url_for('broadcast_status', job_id=job.job_id)
         })
 
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _collect_recipients(message_type, user_ids):
+    """Получатели рассылки [{'user_id', 'chat_id'}] и записи delivered для тех, кому отправить нельзя"""
+    recipients = []
+    failures = []
+    if message_type == 'broadcast':
+        # Всем пользователям
+        for user_id, user_data in iter_users(banned=False, with_chat=True):
+            if user_data.get('chat_id'):
+                recipients.append({
+                    'user_id': user_data.get('user_id'),
+                    'chat_id': user_data['chat_id']
+                })
+    else:
+        # Конкретным пользователям
+        for user_id in user_ids:
+            user_data = load_user_data(user_id)
+            if user_data and user_data.get('chat_id') and not user_data.get('banned', False):
+                recipients.append({
+                    'user_id': user_id,
+                    'chat_id': user_data['chat_id']
+                })
+            else:
+                failures.append({
+                    'user_id': user_id,
+                    'status': 'failed',
+                    'reason': 'User not found or banned'
+                })
+    return recipients, failures
+
+@app.route('/broadcast_status/<job_id>')
+def broadcast_status(job_id):
+    """
+    Ход фоновой рассылки. По умолчанию - поток Server-Sent Events до завершения рассылки,
+    с ?stream=0 - текущее состояние одним JSON.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = get_broadcast(job_id)
+    if not job:
+        return jsonify({'error': 'Рассылка не найдена'}), 404
+    if request.args.get('stream') == '0':
+        return jsonify(job.snapshot())
+
+    def events():
+        version = None
+        while True:
+            # Без изменений состояние все равно отправляется раз в BROADCAST_STATUS_HEARTBEAT секунд
+            version, state = job.wait_for_update(version, BROADCAST_STATUS_HEARTBEAT)
+            yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
+            if state['done']:
+                return
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def _save_message_to_history(message_type, msg_data):
-    """Сохраняет сообщение в соответствующую историю"""
+    """Сохраняет сообщение в соответствующую историю; запись с тем же job_id заменяется"""
     try:
         file_map = {
             'individual': INDIVIDUAL_MSGS_FILE,
@@ -688,68 +710,56 @@ def _save_message_to_history(message_type, msg_data):
         if not file_path:
             raise ValueError("Invalid message type")
         
-        # Чтение существующих сообщений
-        messages = []
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-        
-        # Добавление нового сообщения
-        messages.append(msg_data)
-        
-        # Сохранение
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=4)
+        # Фоновые рассылки дописывают историю по ходу отправки
+        with history_lock:
+            # Чтение существующих сообщений
+            messages = []
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    messages = json.load(f)
+            
+            # Обновление записи рассылки или добавление нового сообщения
+            job_id = msg_data.get('job_id')
+            for index in range(len(messages) - 1, -1, -1):
+                if job_id and messages[index].get('job_id') == job_id:
+                    messages[index] = msg_data
+                    break
+            else:
+                messages.append(msg_data)
+            
+            # Сохранение
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(messages, f, ensure_ascii=False, indent=4)
     except Exception as e:
         logger.error(f"Error saving message history: {str(e)}")
 
 def _send_telegram_message(token, chat_id, text, user_id=None):
-    """Вспомогательная функция для отправки сообщения"""
+    """
+    Вспомогательная функция для отправки сообщения.
+    Ждет своей очереди в общем с ботом лимите исходящих и повторяет отправку после 429.
+    """
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        response = requests.post(url, json={
-            'chat_id': chat_id,
-            'text': text
-        }, timeout=10)
+        config = load_config()
+        limiter = get_outbound_limiter(config)
+        client = get_telegram_client(token, config)
+        for _ in range(MAX_SEND_ATTEMPTS):
+            limiter.wait(chat_id)
+            result = client.send_message(chat_id, text)
+            retry_after = (result.get('parameters') or {}).get('retry_after')
+            if result.get('error_code') != 429 or not retry_after:
+                break
+            limiter.penalize(chat_id, retry_after)
         
-        if response.json().get('ok'):
+        if result.get('ok'):
             return {'success': True}
         else:
-            error = response.json().get('description', 'Unknown error')
+            error = result.get('description', 'Unknown error')
             logger.error(f"Failed to send to {user_id or 'unknown'}/{chat_id}: {error}")
             return {'success': False, 'error': error}
     except Exception as e:
         logger.error(f"Error sending to {user_id or 'unknown'}/{chat_id}: {str(e)}")
         return {'success': False, 'error': str(e)}
 
-def _save_message_to_history(message_type, msg_data):
-    """Сохраняет сообщение в соответствующую историю"""
-    try:
-        file_map = {
-            'individual': INDIVIDUAL_MSGS_FILE,
-            'group': GROUP_MSGS_FILE,
-            'broadcast': BROADCAST_MSGS_FILE
-        }
-        
-        file_path = file_map.get(message_type)
-        if not file_path:
-            raise ValueError("Invalid message type")
-        
-        # Чтение существующих сообщений
-        messages = []
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-        
-        # Добавление нового сообщения
-        messages.append(msg_data)
-        
-        # Сохранение
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logger.error(f"Error saving message history: {str(e)}")
-    
 @app.route('/get_logs')
 def get_logs():
     """Получение логов"""
@@ -776,44 +786,74 @@ def clear_logs():
     except:
         return jsonify({'error': 'Ошибка очистки логов'}), 500
 
+def get_group_schedules_dir():
+    """Папка истории расписаний группы из параметра group (по умолчанию - первой группы)"""
+    sources = get_sources(load_config())
+    group = request.args.get('group')
+    names = [source['name'] for source in sources]
+    if group in names:
+        return source_dir(group)
+    return source_dir(names[0]) if names else SCHEDULES_DIR
+
+@app.route('/get_groups')
+def get_groups():
+    """Список групп (источников расписания)"""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify([source['name'] for source in get_sources(load_config())])
+
 @app.route('/get_schedules')
 def get_schedules():
-    """Получение списка расписаний, включая last_schedule.json"""
+    """
+    Страница списка расписаний из манифеста, от новых к старым.
+    Параметры: page (с 1) и per_page. На первой странице первым идет last_schedule.json.
+    """
     if not session.get('logged_in'):
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        # Получаем все файлы расписаний (кроме last_schedule.json)
-        files = sorted(glob.glob(os.path.join(SCHEDULES_DIR, '*.json')), reverse=True)
-        files = [f for f in files if not f.endswith('last_schedule.json')][:500]
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(max(1, request.args.get('per_page', SCHEDULES_PER_PAGE, type=int)), 500)
+        schedules_dir = get_group_schedules_dir()
+        store = ScheduleStore(schedules_dir)
+        
+        # Одна лишняя запись нужна, чтобы у последней версии страницы была предыдущая для сравнения
+        entries, _ = store.read_manifest(offset=(page - 1) * per_page, limit=per_page + 1)
+        has_more = len(entries) > per_page
         
         schedules = []
         
         # Добавляем last_schedule.json первым в списке
-        last_schedule_file = os.path.join(SCHEDULES_DIR, 'last_schedule.json')
-        if os.path.exists(last_schedule_file):
-            with open(last_schedule_file, 'r', encoding='utf-8') as f:
-                schedule_data = json.load(f)
-                schedules.append({
-                    'filename': 'last_schedule.json',
-                    'update_time': datetime.now().strftime("%d.%m.%Y %H:%M"),
-                    'is_current': True  # Добавляем флаг текущего расписания
-                })
+        last_schedule_file = os.path.join(schedules_dir, 'last_schedule.json')
+        if page == 1 and os.path.exists(last_schedule_file):
+            modified = datetime.fromtimestamp(os.path.getmtime(last_schedule_file))
+            schedules.append({
+                'filename': 'last_schedule.json',
+                'update_time': modified.strftime("%d.%m.%Y %H:%M"),
+                'is_current': True  # Добавляем флаг текущего расписания
+            })
         
-        # Добавляем остальные расписания
-        for file in files:
-            try:
-                with open(file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    schedules.append({
-                        'filename': os.path.basename(file),
-                        'update_time': data.get('update_time', ''),
-                        'is_current': False
-                    })
-            except:
-                continue
+        for index, entry in enumerate(entries[:per_page]):
+            previous = entries[index + 1]['filename'] if index + 1 < len(entries) else None
+            schedules.append({
+                'filename': entry['filename'],
+                'previous': previous,
+                'update_time': entry.get('update_time', ''),
+                'hash': entry.get('hash'),
+                'size': entry.get('size'),
+                'lessons': entry.get('lessons'),
+                'is_current': False
+            })
                 
-        return jsonify(schedules)
+        return jsonify({
+            'schedules': schedules,
+            'page': page,
+            'per_page': per_page,
+            'has_more': has_more,
+            # Файлы старого формата не попадают в манифест до запуска schedule_store.py compact
+            'legacy_files': len(store.legacy_files())
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -824,9 +864,11 @@ def get_schedule(filename):
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        filepath = os.path.join(SCHEDULES_DIR, filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return jsonify(json.load(f))
+        schedules_dir = get_group_schedules_dir()
+        if filename == 'last_schedule.json':
+            with open(os.path.join(schedules_dir, filename), 'r', encoding='utf-8') as f:
+                return jsonify(json.load(f))
+        return jsonify(ScheduleStore(schedules_dir).load_version(filename))
     except:
         return jsonify({'error': 'Schedule not found'}), 404
 
@@ -837,18 +879,17 @@ def get_formatted_schedule(filename):
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        filepath = os.path.join(SCHEDULES_DIR, filename)
+        schedules_dir = get_group_schedules_dir()
         
         # Обработка last_schedule.json
         if filename == 'last_schedule.json':
-            with open(filepath, 'r', encoding='utf-8') as f:
+            with open(os.path.join(schedules_dir, filename), 'r', encoding='utf-8') as f:
                 schedule_data = json.load(f)
                 update_time = datetime.now().strftime("%d.%m.%Y %H:%M")
         else:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                schedule_data = data.get('schedule', {})
-                update_time = data.get('update_time', 'неизвестно')
+            data = ScheduleStore(schedules_dir).load_version(filename)
+            schedule_data = data.get('schedule', {})
+            update_time = data.get('update_time') or 'неизвестно'
         
         if not schedule_data:
             return jsonify({'error': 'Расписание пустое'}), 404
@@ -905,6 +946,136 @@ def get_formatted_schedule(filename):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def load_history_entry(store, schedules_dir, filename):
+    """Расписание из истории (или last_schedule.json) с хешем и временем обновления"""
+    if filename == 'last_schedule.json':
+        path = os.path.join(schedules_dir, filename)
+        with open(path, 'r', encoding='utf-8') as f:
+            schedule_data = json.load(f)
+        return {
+            'schedule': schedule_data,
+            'hash': get_schedule_hash(schedule_data),
+            'update_time': datetime.fromtimestamp(os.path.getmtime(path)).strftime("%d.%m.%Y %H:%M")
+        }
+    data = store.load_version(filename)
+    if not data.get('hash'):
+        data['hash'] = get_schedule_hash(data['schedule'])
+    return data
+
+def get_version_diff(schedules_dir, filename_a, filename_b):
+    """
+    Разница между двумя версиями истории и их описания.
+    Для версий хранилища читаются только записи и изменившиеся дни.
+    """
+    store = ScheduleStore(schedules_dir)
+    if filename_a.endswith(VERSION_SUFFIX) and filename_b.endswith(VERSION_SUFFIX):
+        entry_a = store.load_record(filename_a)
+        entry_b = store.load_record(filename_b)
+    else:
+        entry_a = load_history_entry(store, schedules_dir, filename_a)
+        entry_b = load_history_entry(store, schedules_dir, filename_b)
+
+    key = (entry_a['hash'], entry_b['hash'])
+    diff = diff_cache.get(key)
+    if diff is None:
+        if 'days' in entry_a:
+            diff = store.diff_records(entry_a, entry_b)
+        else:
+            diff = diff_schedules(entry_a['schedule'], entry_b['schedule'])
+        diff_cache[key] = diff
+        while len(diff_cache) > DIFF_CACHE_SIZE:
+            diff_cache.popitem(last=False)
+    else:
+        diff_cache.move_to_end(key)
+
+    versions = [
+        {'filename': filename, 'update_time': entry.get('update_time', ''), 'hash': entry['hash']}
+        for filename, entry in ((filename_a, entry_a), (filename_b, entry_b))
+    ]
+    return diff, versions
+
+def format_diff_lessons(lessons, row_class, mark):
+    """Строки таблицы с занятиями для страницы сравнения"""
+    return "".join(f"""
+                <tr class="{row_class}">
+                    <td>{mark}</td>
+                    <td>{lesson.get('lesson_number', '')}</td>
+                    <td>{lesson.get('name', '')}</td>
+                    <td>{lesson.get('auditorium', '')}</td>
+                    <td>{lesson.get('teacher', '')}</td>
+                    <td>{lesson.get('subgroup') or ''}</td>
+                </tr>
+                """ for lesson in lessons)
+
+@app.route('/get_schedule_diff/<filename_a>/<filename_b>')
+def get_schedule_diff(filename_a, filename_b):
+    """Изменения между двумя версиями расписания: JSON с разницей и готовый HTML"""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        diff, versions = get_version_diff(get_group_schedules_dir(), filename_a, filename_b)
+    except (OSError, ValueError, KeyError):
+        return jsonify({'error': 'Schedule not found'}), 404
+    
+    try:
+        dates = changed_dates(diff)
+        html = f"""
+        <div class="card mb-4">
+            <div class="card-header bg-primary text-white">
+                <h5>Изменения: {versions[0]['update_time']} → {versions[1]['update_time']}</h5>
+            </div>
+            <div class="card-body">
+        """
+        if not dates:
+            html += '<div class="alert alert-info mb-0">Расписания совпадают</div>'
+        
+        for date in dates:
+            if date in diff['added_days']:
+                day = diff['added_days'][date]
+                title = f"{date} ({day.get('day_of_week', '')}) - новый день"
+                rows = format_diff_lessons(day.get('lessons', []), 'table-success', '+')
+            elif date in diff['removed_days']:
+                day = diff['removed_days'][date]
+                title = f"{date} ({day.get('day_of_week', '')}) - день удален"
+                rows = format_diff_lessons(day.get('lessons', []), 'table-danger', '−')
+            else:
+                day = diff['changed_days'][date]
+                title = date + (f" ({day['day_of_week']})" if 'day_of_week' in day else "")
+                rows = format_diff_lessons(day['added'], 'table-success', '+')
+                rows += format_diff_lessons(day['removed'], 'table-danger', '−')
+                for change in day['modified']:
+                    rows += format_diff_lessons(change['old'], 'table-danger', 'было')
+                    rows += format_diff_lessons(change['new'], 'table-warning', 'стало')
+            
+            html += f"""
+            <div class="day-schedule mb-4">
+                <h6 class="day-title text-primary">{title}</h6>
+                <table class="table table-bordered table-sm">
+                    <thead class="thead-dark">
+                        <tr>
+                            <th></th>
+                            <th>№</th>
+                            <th>Предмет</th>
+                            <th>Аудитория</th>
+                            <th>Преподаватель</th>
+                            <th>Подгруппа</th>
+                        </tr>
+                    </thead>
+                    <tbody>{rows}</tbody>
+                </table>
+            </div>
+            """
+        
+        html += """
+            </div>
+        </div>
+        """
+        
+        return jsonify({'diff': diff, 'versions': versions, 'changed_dates': dates, 'html': html})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/logs')
 def logs():
     """Страница логов"""
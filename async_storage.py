@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Значение по умолчанию для ключа storage_workers в config.json
+DEFAULT_STORAGE_WORKERS = 4
+
+class AsyncStorage:
+    """
+    Выполняет файловые операции и запросы к базе в ограниченном пуле потоков,
+    чтобы медленный диск не останавливал цикл событий бота.
+    Записи одного пользователя выполняются строго по очереди.
+    """
+
+    def __init__(self, max_workers=DEFAULT_STORAGE_WORKERS):
+        self.max_workers = max_workers
+        self.executor = None
+        self.user_locks = {}  # {user_id: [asyncio.Lock, число ожидающих]}
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='storage')
+        return self.executor
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет func(*args, **kwargs) в пуле и возвращает результат"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def run_for_user(self, user_id, func, *args, **kwargs):
+        """Как run, но операции одного пользователя не пересекаются и идут в порядке вызова"""
+        entry = self.user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self.run(func, *args, **kwargs)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.user_locks[user_id]
+
+    def submit(self, func, *args, **kwargs):
+        """Запускает func в пуле, не дожидаясь результата; ошибки пишутся в лог"""
+        future = self._get_executor().submit(func, *args, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Ошибка фоновой операции с хранилищем: {future.exception()}")
+
+    def shutdown(self, wait=True):
+        """Дожидается начатых операций и останавливает пул"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк записи активности пользователей (log_user_activity).
+
+Сравниваются три способа на одном и том же потоке обновлений, где каждое
+обновление пишет два события (handle_message и show_schedule):
+  json_files  - прежняя схема: users/<id>.json переписывается дважды на событие;
+  sqlite      - отдельная транзакция modify_user_data на каждое событие;
+  buffered    - ActivityBuffer: пачки в журнал действий, в профиле только счетчики.
+Для каждого замеряется время на обновление и объем записанных байт (/proc/self/io, только Linux).
+Результат сохраняется в benchmarks/results/<время>_<коммит>_activity.json.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_activity.py [--users 1000] [--updates 5000] [--history 50]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, ROOT_DIR)
+
+import activity_log
+import user_repository
+from activity_buffer import DEFAULT_FLUSH_SIZE, ActivityBuffer
+from bench_parser import git_commit
+
+logging.getLogger().setLevel(logging.WARNING)
+
+def written_bytes():
+    """Байты, записанные процессом через write (None, если /proc недоступен)"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def make_profile(user_id, history):
+    return {
+        'user_id': user_id,
+        'username': f"user{user_id}",
+        'first_seen': datetime.now().isoformat(),
+        'last_seen': datetime.now().isoformat(),
+        'notifications': True,
+        'actions': [{'time': datetime.now().isoformat(), 'action': 'button_press',
+                     'chat_id': user_id, 'user_id': user_id}] * history,
+        'chat_id': user_id,
+        'banned': False,
+        'ban_reason': None
+    }
+
+def json_files_logger(users_dir):
+    """Прежний log_user_activity: update_user_data и повторная запись файла с новым действием"""
+    def log(user_id, username, action, chat_id):
+        user_file = os.path.join(users_dir, f"{user_id}.json")
+        with open(user_file, 'r', encoding='utf-8') as f:
+            user_data = json.load(f)
+        user_data.update({'username': username, 'last_seen': datetime.now().isoformat(), 'chat_id': chat_id})
+        with open(user_file, 'w', encoding='utf-8') as f:
+            json.dump(user_data, f, ensure_ascii=False, indent=4)
+        user_data['actions'].append({'time': datetime.now().isoformat(), 'action': action,
+                                     'chat_id': chat_id, 'user_id': user_id})
+        with open(user_file, 'w', encoding='utf-8') as f:
+            json.dump(user_data, f, ensure_ascii=False, indent=4)
+    return log, None
+
+def sqlite_logger(users_dir):
+    """Транзакция на каждое событие"""
+    def log(user_id, username, action, chat_id):
+        def record(user_data):
+            user_data['username'] = username
+            user_data['last_seen'] = datetime.now().isoformat()
+            user_data['chat_id'] = chat_id
+            user_data['actions'].append({'time': datetime.now().isoformat(), 'action': action,
+                                         'chat_id': chat_id, 'user_id': user_id})
+        user_repository.modify_user_data(user_id, record)
+    return log, None
+
+def buffered_logger(users_dir, flush_size):
+    """Запись пачками через ActivityBuffer"""
+    buffer = ActivityBuffer(flush_size)
+    return buffer.record, buffer.flush
+
+def run_scenario(name, users, updates, history, flush_size):
+    workdir = tempfile.mkdtemp(prefix='bench_activity_')
+    users_dir = os.path.join(workdir, 'users')
+    os.makedirs(users_dir)
+    try:
+        if name == 'json_files':
+            for user_id in range(users):
+                with open(os.path.join(users_dir, f"{user_id}.json"), 'w', encoding='utf-8') as f:
+                    json.dump(make_profile(user_id, history), f, ensure_ascii=False, indent=4)
+            log, flush = json_files_logger(users_dir)
+        else:
+            user_repository.DB_FILE = os.path.join(users_dir, 'users.db')
+            connection = user_repository.get_connection()
+            connection.execute("BEGIN")
+            for user_id in range(users):
+                profile = make_profile(user_id, history)
+                if name == 'buffered':
+                    # История уже перенесена в журнал
+                    profile['total_actions'] = len(profile.pop('actions'))
+                user_repository._write(connection, user_id, profile)
+            connection.execute("COMMIT")
+            if name == 'sqlite':
+                log, flush = sqlite_logger(users_dir)
+            else:
+                activity_log._activity_log = activity_log.ActivityLog(os.path.join(users_dir, 'activity'))
+                log, flush = buffered_logger(users_dir, flush_size)
+
+        rng = random.Random(1)
+        stream = [rng.randrange(users) for _ in range(updates)]
+        before = written_bytes()
+        started = time.perf_counter()
+        for user_id in stream:
+            log(user_id, f"user{user_id}", "button_press", user_id)
+            log(user_id, f"user{user_id}", "schedule_request", user_id)
+        if flush:
+            flush()
+        elapsed = time.perf_counter() - started
+        after = written_bytes()
+
+        return {
+            'updates': updates,
+            'us_per_update': round(elapsed / updates * 1e6, 1),
+            'updates_per_sec': round(updates / elapsed, 1),
+            'kb_written_per_update': round((after - before) / updates / 1024, 2) if before is not None else None,
+        }
+    finally:
+        for connection in getattr(user_repository._local, 'connections', {}).values():
+            connection.close()
+        user_repository._local.connections = {}
+        activity_log._activity_log = None
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк записи активности пользователей')
+    arg_parser.add_argument('--users', type=int, default=1000, help='число пользователей')
+    arg_parser.add_argument('--updates', type=int, default=5000, help='число обновлений')
+    arg_parser.add_argument('--history', type=int, default=50, help='действий в истории каждого пользователя')
+    arg_parser.add_argument('--flush-size', type=int, default=DEFAULT_FLUSH_SIZE, help='размер пачки буфера')
+    args = arg_parser.parse_args()
+
+    results = {}
+    for name in ('json_files', 'sqlite', 'buffered'):
+        results[name] = run_scenario(name, args.users, args.updates, args.history, args.flush_size)
+
+    report = {
+        'commit': git_commit(),
+        'time': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'args': vars(args),
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['commit']}_activity.json"
+    path = os.path.join(RESULTS_DIR, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print(f"Коммит {report['commit']}, пользователей {args.users}, обновлений {args.updates}, "
+          f"история {args.history}, пачка {args.flush_size}")
+    print(f"{'схема':<14}{'мкс/обн':>12}{'обн/с':>12}{'КБ/обн':>12}")
+    for name, stats in results.items():
+        print(f"{name:<14}{stats['us_per_update']:>12}{stats['updates_per_sec']:>12}"
+              f"{stats['kb_written_per_update'] if stats['kb_written_per_update'] is not None else '-':>12}")
+    print(f"Результаты сохранены в {path}")
+
+if __name__ == '__main__':
+    main()
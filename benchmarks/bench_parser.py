@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк парсера расписания на страницах из benchmarks/fixtures.
+
+Для каждой страницы замеряются движки parse_schedule, а также
+get_schedule_hash и save_to_json: пропускная способность, p50/p99 и пик памяти.
+Результат сохраняется в benchmarks/results/<время>_<коммит>.json.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_parser.py [--runs 50] [--compare results/старый.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, ROOT_DIR)
+
+import parser as schedule_parser
+
+# save_to_json пишет в лог при каждом вызове
+logging.getLogger().setLevel(logging.WARNING)
+
+def percentile(values, share):
+    """Перцентиль по отсортированной выборке"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+def measure(func, runs, size):
+    """Замеряет время выполнения и пик памяти функции без аргументов"""
+    func()  # прогрев
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(timings)
+    return {
+        'runs': runs,
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'ops_per_sec': round(runs / total, 2) if total else None,
+        'mb_per_sec': round(size * runs / total / 1024 / 1024, 3) if total and size else None,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+def git_commit():
+    """Короткий хеш текущего коммита"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(runs):
+    """Прогоняет все страницы и возвращает результаты"""
+    results = {}
+    fixtures = sorted(f for f in os.listdir(FIXTURES_DIR) if f.endswith('.html'))
+    engines = [engine for engine in schedule_parser.PARSER_ENGINES
+               if engine != 'lxml' or schedule_parser.lxml is not None]
+
+    # save_to_json пишет в schedules/ относительно рабочей папки
+    workdir = tempfile.mkdtemp(prefix='bench_parser_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for fixture in fixtures:
+            with open(os.path.join(FIXTURES_DIR, fixture), 'r', encoding='windows-1251') as f:
+                html_content = f.read()
+            size = len(html_content.encode('windows-1251'))
+            schedule_data = schedule_parser.parse_schedule_bs4(html_content)
+            lessons = sum(len(day['lessons']) for day in schedule_data.values())
+
+            entry = {'size_bytes': size, 'days': len(schedule_data), 'lessons': lessons}
+            engine_funcs = {
+                'lxml': schedule_parser.parse_schedule_lxml,
+                'bs4': schedule_parser.parse_schedule_bs4,
+            }
+            for engine in engines:
+                parse = engine_funcs[engine]
+                entry[f'parse_{engine}'] = measure(lambda: parse(html_content), runs, size)
+                if parse(html_content) != schedule_data:
+                    entry[f'parse_{engine}']['mismatch'] = True
+
+            entry['get_schedule_hash'] = measure(
+                lambda: schedule_parser.get_schedule_hash(schedule_data), runs, None)
+            entry['save_to_json'] = measure(
+                lambda: schedule_parser.save_to_json(schedule_data, 'bench.json'), runs, None)
+            results[fixture] = entry
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'commit': git_commit(),
+        'time': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'runs': runs,
+        'results': results,
+    }
+
+def print_report(report, baseline=None):
+    """Печатает таблицу результатов и изменение p50 относительно baseline"""
+    print(f"Коммит {report['commit']}, Python {report['python']}, прогонов: {report['runs']}")
+    header = f"{'страница':<22}{'операция':<20}{'p50 мс':>10}{'p99 мс':>10}{'оп/с':>10}{'пик КБ':>10}"
+    if baseline:
+        header += f"{'Δp50':>9}"
+    print(header)
+    for fixture, entry in report['results'].items():
+        for name, stats in entry.items():
+            if not isinstance(stats, dict):
+                continue
+            line = (f"{fixture:<22}{name:<20}{stats['p50_ms']:>10}{stats['p99_ms']:>10}"
+                    f"{stats['ops_per_sec']:>10}{stats['peak_memory_kb']:>10}")
+            old = (baseline or {}).get('results', {}).get(fixture, {}).get(name)
+            if old and old.get('p50_ms'):
+                line += f"{(stats['p50_ms'] / old['p50_ms'] - 1) * 100:>+8.1f}%"
+            if stats.get('mismatch'):
+                line += '  РЕЗУЛЬТАТ ОТЛИЧАЕТСЯ ОТ bs4'
+            print(line)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк парсера расписания')
+    arg_parser.add_argument('--runs', type=int, default=50, help='число замеров на операцию')
+    arg_parser.add_argument('--compare', help='файл результатов для сравнения')
+    args = arg_parser.parse_args()
+
+    report = run(args.runs)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['commit']}.json"
+    path = os.path.join(RESULTS_DIR, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"Результаты сохранены в {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк отправки сообщений из админ-панели через Bot API.
+
+Запускается локальный поддельный сервер Bot API (sendMessage отвечает сразу),
+и на нем сравниваются:
+  requests_post - прежняя схема: requests.post с новым соединением на каждое сообщение;
+  client        - telegram_api.TelegramClient: общий пул соединений с keep-alive;
+  client_http2  - то же через httpx с HTTP/2 (только с --tls и установленным h2).
+С --tls сервер работает по HTTPS с самоподписанным сертификатом (нужен openssl),
+что ближе к api.telegram.org: без keep-alive каждое сообщение платит и за TLS-рукопожатие.
+Замеряется задержка на сообщение (p50/p99) и пропускная способность при --concurrency потоках.
+Результат сохраняется в benchmarks/results/<время>_<коммит>_telegram_api.json.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_telegram_api.py [--messages 500] [--concurrency 1] [--tls]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, ROOT_DIR)
+
+import requests
+
+from bench_parser import git_commit, percentile
+from telegram_api import TelegramClient
+
+logging.getLogger().setLevel(logging.WARNING)
+
+TOKEN = '123:bench'
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Отвечает на sendMessage как Bot API; соединения держатся открытыми (HTTP/1.1)"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Заголовки и тело уходят отдельными записями; без TCP_NODELAY keep-alive
+        # соединение ловит задержку Nagle + delayed ACK (~40 мс), которой нет у настоящего API
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        params = json.loads(body or b'{}')
+        payload = json.dumps({
+            'ok': True,
+            'result': {'message_id': 1, 'chat': {'id': params.get('chat_id')}, 'text': params.get('text')}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(workdir, tls):
+    """Запускает сервер на свободном порту и возвращает (сервер, адрес API, путь к сертификату)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    server.daemon_threads = True
+    cert = None
+    if tls:
+        import ssl
+        cert = os.path.join(workdir, 'cert.pem')
+        key = os.path.join(workdir, 'key.pem')
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-keyout', key, '-out', cert, '-subj', '/CN=127.0.0.1',
+             '-addext', 'subjectAltName=IP:127.0.0.1'],
+            check=True, capture_output=True
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheme = 'https' if tls else 'http'
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}", cert
+
+def requests_post_sender(api_url):
+    """Прежний _send_telegram_message: requests.post без общей сессии"""
+    url = f"{api_url}/bot{TOKEN}/sendMessage"
+
+    def send(chat_id, text):
+        return requests.post(url, json={'chat_id': chat_id, 'text': text}, timeout=10).json()
+    return send, None
+
+def client_sender(api_url, concurrency, http2=False):
+    client = TelegramClient(TOKEN, api_url, pool_size=max(1, concurrency), http2=http2)
+    if http2 and not client.http2:
+        client.close()
+        return None, None
+    return client.send_message, client.close
+
+def run_scenario(send, messages, concurrency):
+    def one(index):
+        started = time.perf_counter()
+        result = send(index, f"Сообщение {index}")
+        elapsed = time.perf_counter() - started
+        if not result.get('ok'):
+            raise RuntimeError(f"Неуспешный ответ: {result}")
+        return elapsed
+
+    send(0, 'прогрев')
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(messages)))
+    total = time.perf_counter() - started
+    return {
+        'messages': messages,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'messages_per_sec': round(messages / total, 1),
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк клиента Bot API')
+    arg_parser.add_argument('--messages', type=int, default=500, help='число сообщений')
+    arg_parser.add_argument('--concurrency', type=int, default=1, help='потоков отправки')
+    arg_parser.add_argument('--tls', action='store_true', help='HTTPS с самоподписанным сертификатом')
+    args = arg_parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_telegram_api_')
+    old_env = {name: os.environ.get(name) for name in ('REQUESTS_CA_BUNDLE', 'SSL_CERT_FILE')}
+    server = None
+    try:
+        server, api_url, cert = start_server(workdir, args.tls)
+        if cert:
+            # Сертификат сервера доверенный и для requests.post, и для сессии клиента
+            os.environ['REQUESTS_CA_BUNDLE'] = cert
+            os.environ['SSL_CERT_FILE'] = cert
+
+        results = {}
+        scenarios = [
+            ('requests_post', lambda: requests_post_sender(api_url)),
+            ('client', lambda: client_sender(api_url, args.concurrency)),
+        ]
+        if args.tls:
+            scenarios.append(('client_http2', lambda: client_sender(api_url, args.concurrency, http2=True)))
+        for name, make in scenarios:
+            send, close = make()
+            if send is None:
+                print(f"{name}: пропущен (HTTP/2 недоступен)")
+                continue
+            try:
+                results[name] = run_scenario(send, args.messages, args.concurrency)
+            finally:
+                if close:
+                    close()
+    finally:
+        if server:
+            server.shutdown()
+        for name, value in old_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'time': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'args': vars(args),
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['commit']}_telegram_api.json"
+    path = os.path.join(RESULTS_DIR, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print(f"Коммит {report['commit']}, сообщений {args.messages}, потоков {args.concurrency}, "
+          f"{'HTTPS' if args.tls else 'HTTP'}")
+    print(f"{'схема':<16}{'p50 мс':>10}{'p99 мс':>10}{'сообщ/с':>12}")
+    for name, stats in results.items():
+        print(f"{name:<16}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['messages_per_sec']:>12}")
+    print(f"Результаты сохранены в {path}")
+
+if __name__ == '__main__':
+    main()
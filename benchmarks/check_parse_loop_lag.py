@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Проверка: разбор расписания во время проверки не задерживает обработчики команд.
+
+Моделируется проверка расписания: страницы из benchmarks/fixtures разбираются
+--rounds раз для каждого из --sources источников, как в check_schedule_changes.
+Одновременно обработчик-зонд срабатывает раз в --interval секунд, и замеряется
+его задержка от запланированного момента, а также bot.measure_loop_lag. Режимы:
+  inline - parse_schedule_page прямо в цикле событий (как раньше);
+  pool   - bot.parse_schedule_off_loop (пул процессов).
+Скрипт завершается с кодом 1, если в режиме pool p99 задержки зонда больше --limit мс.
+
+Запуск из корня репозитория:
+    python benchmarks/check_parse_loop_lag.py [--sources 4] [--rounds 5] [--limit 20]
+"""
+import os
+import sys
+import asyncio
+import logging
+import argparse
+import tempfile
+import shutil
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+sys.path.insert(0, ROOT_DIR)
+
+from bench_parser import percentile
+
+async def parse_inline(bot, html_content, engine):
+    """Прежнее поведение: разбор прямо в цикле событий"""
+    from parser import parse_schedule_page
+    return parse_schedule_page(html_content, engine)
+
+async def parse_pool(bot, html_content, engine):
+    return await bot.parse_schedule_off_loop(html_content, engine)
+
+async def probe(stop_event, interval, latencies):
+    """
+    Обработчик-зонд: срабатывает раз в interval секунд до остановки.
+    Задержка считается от запланированного момента, как ответ пользователю.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    index = 0
+    while not stop_event.is_set():
+        planned = started + index * interval
+        await asyncio.sleep(max(0, planned - loop.time()))
+        latencies.append(loop.time() - planned)
+        index += 1
+
+async def run_mode(bot, parse, pages, sources, rounds, engine, interval):
+    # Прогрев: в режиме pool запускается процесс пула
+    await parse(bot, pages[0], engine)
+
+    async def check_source():
+        for _ in range(rounds):
+            for html_content in pages:
+                await parse(bot, html_content, engine)
+
+    latencies = []
+    probe_stop = asyncio.Event()
+    lag_stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(probe_stop, interval, latencies))
+    lag_task = asyncio.create_task(bot.measure_loop_lag(lag_stop, interval))
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        await asyncio.gather(*(check_source() for _ in range(sources)))
+    finally:
+        duration = loop.time() - started
+        probe_stop.set()
+        lag_stop.set()
+        await probe_task
+        max_lag = await lag_task
+    return {
+        'check_s': round(duration, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_lag_ms': round(max_lag * 1000, 1),
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Проверка задержки цикла событий при разборе расписания')
+    arg_parser.add_argument('--sources', type=int, default=4, help='число источников в проверке')
+    arg_parser.add_argument('--rounds', type=int, default=5, help='проходов по страницам на источник')
+    arg_parser.add_argument('--interval', type=float, default=0.01, help='период обработчика-зонда, с')
+    arg_parser.add_argument('--engine', default=None, help='движок парсинга (по умолчанию как в parser.py)')
+    arg_parser.add_argument('--limit', type=float, default=20, help='допустимая p99 задержка зонда, мс')
+    args = arg_parser.parse_args()
+
+    pages = []
+    for fixture in sorted(f for f in os.listdir(FIXTURES_DIR) if f.endswith('.html')):
+        with open(os.path.join(FIXTURES_DIR, fixture), 'r', encoding='windows-1251') as f:
+            pages.append(f.read())
+
+    workdir = tempfile.mkdtemp(prefix='check_parse_lag_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import bot
+        from parser import DEFAULT_PARSER_ENGINE
+        logging.getLogger().setLevel(logging.WARNING)
+        engine = args.engine or DEFAULT_PARSER_ENGINE
+
+        results = {}
+        for mode, parse in (('inline', parse_inline), ('pool', parse_pool)):
+            results[mode] = asyncio.run(run_mode(
+                bot, parse, pages, args.sources, args.rounds, engine, args.interval))
+        if bot.parse_pool:
+            bot.parse_pool.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Движок {engine}; источников {args.sources}, по {args.rounds} проходов "
+          f"по {len(pages)} страницам; зонд раз в {args.interval * 1000:.0f} мс")
+    print(f"{'режим':<10}{'проверка с':>12}{'p50 мс':>10}{'p99 мс':>10}{'лаг мс':>10}")
+    for mode, stats in results.items():
+        print(f"{mode:<10}{stats['check_s']:>12}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_lag_ms']:>10}")
+
+    if results['pool']['p99_ms'] > args.limit:
+        print(f"ОШИБКА: p99 задержки обработчика {results['pool']['p99_ms']} мс больше {args.limit} мс")
+        sys.exit(1)
+    print("OK: разбор расписания не задерживает обработчики команд")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Проверка: медленный диск у одного пользователя не задерживает остальных.
+
+Чтение и запись профиля одного пользователя искусственно замедляются на --delay секунд
+(задержка вне транзакции - как зависший на диске read/write, а не удержание блокировки базы).
+Этот пользователь шлет /notif, а остальные одновременно шлют /start и /notif.
+Замеряется задержка ответов остальным в двух режимах:
+  inline - операции с хранилищем выполняются прямо в цикле событий (как раньше);
+  pool   - через AsyncStorage (пул потоков и очередь на пользователя).
+Скрипт завершается с кодом 1, если в режиме pool p99 задержки остальных больше --limit мс.
+
+Запуск из корня репозитория:
+    python benchmarks/check_storage_latency.py [--users 20] [--delay 0.5] [--limit 100]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import shutil
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from bench_parser import percentile
+
+SLOW_USER = 1
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replied = None
+
+    async def reply_text(self, text, reply_markup=None):
+        self.replied = time.perf_counter()
+
+class FakeUpdate:
+    def __init__(self, user_id, text):
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeUser(user_id)
+        self.message = FakeMessage(text)
+
+class InlineStorage:
+    """Прежнее поведение: операции выполняются синхронно в цикле событий"""
+    max_workers = 1
+
+    async def run(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    async def run_for_user(self, user_id, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def shutdown(self, wait=True):
+        pass
+
+def slow_down(bot, delay):
+    """Замедляет чтение и запись профиля SLOW_USER в обработчиках бота"""
+    def slowed(func):
+        def wrapper(user_id, *args, **kwargs):
+            if str(user_id) == str(SLOW_USER):
+                time.sleep(delay)
+            return func(user_id, *args, **kwargs)
+        return wrapper
+
+    bot.load_user_data = slowed(bot.load_user_data)
+    bot.update_user_data = slowed(bot.update_user_data)
+
+async def user_session(bot, user_id, rounds, interval, latencies):
+    """
+    Пользователь шлет /start и /notif по расписанию раз в interval секунд.
+    Задержка считается от запланированного момента запроса, поэтому
+    включает и время, пока цикл событий был занят чужими операциями.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for index in range(rounds):
+        planned = started + index * interval
+        await asyncio.sleep(max(0, planned - loop.time()))
+        handler = bot.start if index % 2 == 0 else bot.toggle_notifications
+        update = FakeUpdate(user_id, '/start')
+        await handler(update, None)
+        if latencies is not None:
+            latencies.append(loop.time() - planned)
+
+async def run_mode(bot, storage, users, rounds, interval):
+    bot.storage = storage
+    bot.rate_limiter.clear()
+    latencies = []
+    await asyncio.gather(
+        user_session(bot, SLOW_USER, rounds, interval, None),
+        *(user_session(bot, user_id, rounds, interval, latencies) for user_id in range(2, users + 2))
+    )
+    storage.shutdown()
+    return latencies
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Проверка изоляции медленного хранилища')
+    arg_parser.add_argument('--users', type=int, default=20, help='число обычных пользователей')
+    arg_parser.add_argument('--rounds', type=int, default=6, help='запросов на пользователя')
+    arg_parser.add_argument('--delay', type=float, default=0.5, help='задержка I/O медленного пользователя, с')
+    arg_parser.add_argument('--interval', type=float, default=0.2, help='пауза между запросами пользователя, с')
+    arg_parser.add_argument('--limit', type=float, default=100, help='допустимая p99 задержка остальных, мс')
+    args = arg_parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='check_storage_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import bot
+        from async_storage import AsyncStorage
+        logging.getLogger().setLevel(logging.WARNING)
+        slow_down(bot, args.delay)
+
+        results = {}
+        for mode, storage in (('inline', InlineStorage()), ('pool', AsyncStorage())):
+            latencies = asyncio.run(run_mode(bot, storage, args.users, args.rounds, args.interval))
+            results[mode] = {
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(max(latencies) * 1000, 1),
+            }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Медленный пользователь: задержка I/O {args.delay} с; остальных {args.users}, по {args.rounds} запросов")
+    print(f"{'режим':<10}{'p50 мс':>10}{'p99 мс':>10}{'макс мс':>10}")
+    for mode, stats in results.items():
+        print(f"{mode:<10}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+    if results['pool']['p99_ms'] > args.limit:
+        print(f"ОШИБКА: p99 остальных пользователей {results['pool']['p99_ms']} мс больше {args.limit} мс")
+        sys.exit(1)
+    print("OK: медленное хранилище одного пользователя не задерживает остальных")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Генерирует обезличенные страницы расписания (table.inf) для бенчмарков.
+Разметка повторяет страницу сайта: строка с датой (rowspan), номер пары,
+ячейка с ссылками z1/z2/z3 или свободная ячейка nul, разделители hd0.
+
+Запуск: python benchmarks/make_fixtures.py
+"""
+import os
+import random
+from datetime import date, timedelta
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+DAYS_OF_WEEK = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб']
+SUBJECTS = [
+    'Математика', 'Физика', 'Информатика', 'История', 'Иностранный язык',
+    'Базы данных', 'Программирование', 'Компьютерные сети', 'Физическая культура',
+    'Экономика', 'Операционные системы', 'Дискретная математика'
+]
+TEACHERS = ['Преподаватель {0} А.Б.'.format(i) for i in range(1, 41)]
+
+# Имя файла -> (число учебных дней, пар в день, доля пар с подгруппами)
+FIXTURES = {
+    'day_1.html': (1, 6, 0.1),
+    'week_1.html': (6, 6, 0.1),
+    'weeks_4.html': (24, 6, 0.1),
+    'subgroups_week.html': (6, 6, 0.9),
+}
+
+def lesson_links(rng, subgroups):
+    """Содержимое ячейки с занятием (несколько занятий - подгруппы)"""
+    parts = []
+    for _ in range(subgroups):
+        parts.append(
+            f'<a class="z1" href="#">{rng.choice(SUBJECTS)}</a><br>'
+            f'<a class="z2" href="#">{rng.randint(100, 450)}</a> '
+            f'<a class="z3" href="#">{rng.choice(TEACHERS)}</a>'
+        )
+    return '<br>'.join(parts)
+
+def make_page(days, lessons_per_day, subgroup_share, seed=1):
+    """Строит HTML-страницу расписания"""
+    rng = random.Random(seed)
+    start = date(2024, 9, 2)
+    rows = [
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=windows-1251">',
+        '<title>Расписание</title></head><body>',
+        '<table class="inf" cellspacing="0" border="1">',
+        '<tr><td class="hd" colspan="3">Группа ГР-01</td></tr>',
+        '<tr><td class="hd">Дата</td><td class="hd">Пара</td><td class="hd">Занятие</td></tr>',
+    ]
+    day = start
+    for _ in range(days):
+        if day.weekday() == 6:
+            day += timedelta(days=1)
+        for number in range(1, lessons_per_day + 1):
+            cells = []
+            if number == 1:
+                cells.append(
+                    f'<td class="hd" rowspan="{lessons_per_day}">'
+                    f'{day.strftime("%d.%m.%Y")}<br>{DAYS_OF_WEEK[day.weekday()]}</td>'
+                )
+            cells.append(f'<td class="hd">{number}</td>')
+            if rng.random() < 0.25:
+                cells.append('<td class="nul">&nbsp;</td>')
+            else:
+                subgroups = rng.choice([2, 3]) if rng.random() < subgroup_share else 1
+                cells.append(f'<td class="ur">{lesson_links(rng, subgroups)}</td>')
+            rows.append('<tr>' + ''.join(cells) + '</tr>')
+        rows.append('<tr><td class="hd0" colspan="3"></td></tr>')
+        day += timedelta(days=1)
+    rows.append('</table></body></html>')
+    return '\n'.join(rows)
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for filename, (days, lessons, subgroup_share) in FIXTURES.items():
+        path = os.path.join(FIXTURES_DIR, filename)
+        with open(path, 'w', encoding='windows-1251') as f:
+            f.write(make_page(days, lessons, subgroup_share))
+        print(f"{path}: {os.path.getsize(path)} байт")
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,11 @@ import hashlib
 import sys
 import os
 import asyncio
-import glob
-from datetime import datetime, timedelta
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 import psutil
 from telegram import Update, ReplyKeyboardMarkup, Bot
 from telegram.error import InvalidToken, RetryAfter
@@ -34,81 +37,185 @@ os.makedirs(SCHEDULES_DIR, exist_ok=True)
 from log_handler import setup_logging
 logger = setup_logging()
 
+from schedule_diff import (
+    MAX_MESSAGE_LENGTH,
+    diff_schedules,
+    format_diff,
+    has_changes,
+    message_length,
+    significant_changes
+)
+from schedule_store import ScheduleStore
+from sources import (
+    DEFAULT_MAX_CONCURRENT_FETCHES,
+    find_source,
+    get_sources,
+    source_dir,
+    user_groups
+)
+from user_repository import (
+    DEFAULT_FLAGS_REFRESH,
+    check_subscriptions,
+    get_user_flags,
+    load_user_data,
+    modify_user_data,
+    update_user_data
+)
+from async_storage import DEFAULT_STORAGE_WORKERS, AsyncStorage
+from activity_buffer import DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_SIZE, ActivityBuffer
+from activity_log import get_activity_log
+from rate_limiter import DEFAULT_LIMIT, DEFAULT_MAX_BUCKETS, RateLimiter
+from outbound_limiter import MAX_SEND_ATTEMPTS, get_outbound_limiter
+from fanout import DEFAULT_FANOUT_CONCURRENCY, FanOutStats, fan_out
+import outbox
+from single_flight import SingleFlight
+from outbox import DEFAULT_OUTBOX_BATCH, DEFAULT_OUTBOX_KEEP_DAYS
+
 # Глобальные переменные
 user_states = {}
+# Файлы и база пользователей из обработчиков - только через этот пул
+storage = AsyncStorage()
+activity_buffer = ActivityBuffer(on_full=lambda: storage.submit(activity_buffer.flush))
 application = None
 shutdown_event = asyncio.Event()
-user_requests = {}
+rate_limiter = RateLimiter()
+outbox_task = None  # Отправка очереди рассылок
+outbox_wakeup = asyncio.Event()  # Появилось новое задание рассылки
+# Одновременные запросы расписания одной группы (например, после рассылки) делят одну загрузку
+schedule_loads = SingleFlight()
+parse_pool = None  # Пул процессов для парсинга; False - процессы недоступны (например, Termux)
+config_cache = {'key': None, 'config': None}
+schedule_cache = {}  # {путь к last_schedule.json: (ключ файла, данные расписания)}
+rendered_schedule_cache = OrderedDict()  # {(хеш, заголовок): [части сообщения]}
+RENDERED_CACHE_SIZE = 32
+
+def file_key(path):
+    """Ключ версии файла: меняется при перезаписи или замене файла"""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
 
 def load_config():
-    """Загрузка конфигурации из файла"""
+    """Загрузка конфигурации из файла (перечитывается только при изменении файла)"""
     try:
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        key = file_key(CONFIG_FILE)
+        if config_cache['key'] != key:
+            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                config_cache['config'] = json.load(f)
+            config_cache['key'] = key
+        return config_cache['config']
     except Exception as e:
         logger.error(f"Ошибка загрузки конфигурации: {e}")
         return None
 
-def save_schedule(update_time, schedule):
-    """Сохраняет расписание с хешем в папку schedules и в last_schedule.json"""
+def save_schedule(update_time, schedule, source_name=None):
+    """Сохраняет расписание с хешем в папку источника и в её last_schedule.json"""
     try:
         schedule_hash = hashlib.md5(
             json.dumps(schedule, sort_keys=True).encode('utf-8')
         ).hexdigest()
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_schedule.json"
-        filepath = os.path.join(SCHEDULES_DIR, filename)
+        schedules_dir = get_schedules_dir(source_name)
+        os.makedirs(schedules_dir, exist_ok=True)
+        store = ScheduleStore(schedules_dir)
         
-        # Сохраняем полную версию с метаданными
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump({
-                'update_time': update_time,
-                'schedule': schedule,
-                'hash': schedule_hash
-            }, f, ensure_ascii=False, indent=4)
+        # Сохраняем версию в историю: повторяющиеся дни хранятся один раз
+        store.save_version(update_time, schedule, schedule_hash)
         
         # Сохраняем упрощенную версию в last_schedule.json
-        last_schedule_file = os.path.join(SCHEDULES_DIR, 'last_schedule.json')
+        last_schedule_file = os.path.join(schedules_dir, 'last_schedule.json')
         with open(last_schedule_file, 'w', encoding='utf-8') as f:
             json.dump(schedule, f, ensure_ascii=False, indent=4)
         
-        # Удаляем старые файлы (>500)
-        schedule_files = sorted(glob.glob(os.path.join(SCHEDULES_DIR, '*.json')))
-        if len(schedule_files) > 500:
-            for file in schedule_files[:-500]:
-                try:
-                    if not file.endswith('last_schedule.json'):  # Не удаляем last_schedule.json
-                        os.remove(file)
-                except Exception as e:
-                    logger.error(f"Ошибка удаления старого файла расписания: {e}")
+        # Обновляем кеш, чтобы не перечитывать только что записанный файл
+        schedule_cache[last_schedule_file] = (file_key(last_schedule_file), {
+            'update_time': update_time,
+            'schedule': schedule,
+            'hash': schedule_hash
+        })
+        
+        # Удаляем старые версии (>500) и дни, на которые они ссылались
+        store.prune(keep=500)
         
         return schedule_hash
     except Exception as e:
         logger.error(f"Ошибка сохранения расписания: {e}")
         return None
 
-def get_latest_schedule():
-    """Получает последнее сохраненное расписание из last_schedule.json или парсит новое"""
+def save_schedule_with_diff(update_time, schedule, old_data, source_name=None):
+    """
+    Сохраняет новое расписание и возвращает его разницу с old_data.
+    Если old_data - последняя версия в хранилище, разница берется из ScheduleStore.diff_records
+    по хешам дней из записей версий (она уже посчитана при сохранении), иначе считается заново.
+    """
+    store = ScheduleStore(get_schedules_dir(source_name))
+    previous = None
+    versions = store.list_versions()
+    if old_data and versions:
+        try:
+            record = store.load_record(versions[-1])
+            if record.get('hash') == old_data.get('hash'):
+                previous = record
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать версию {versions[-1]}: {e}")
+
+    schedule_hash = save_schedule(update_time, schedule, source_name)
+
+    known = set(versions)
+    added = [name for name in store.list_versions() if name not in known]
+    if previous is not None and schedule_hash and added:
+        try:
+            current = store.load_record(added[-1])
+            if current.get('hash') == schedule_hash:
+                return store.diff_records(previous, current)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Не удалось сравнить сохраненные версии: {e}")
+    return diff_schedules(old_data.get('schedule') if old_data else {}, schedule)
+
+def get_schedules_dir(source_name=None):
+    """Папка истории расписаний источника (по умолчанию - первого из конфига)"""
+    if source_name is None:
+        source = find_source(load_config())
+        source_name = source['name'] if source else None
+    return source_dir(source_name) if source_name else SCHEDULES_DIR
+
+def get_latest_schedule(source_name=None):
+    """
+    Получает последнее сохраненное расписание из last_schedule.json или парсит новое.
+    Разобранное расписание и его хеш держатся в памяти, пока файл не изменится.
+    """
     try:
         # Сначала пробуем загрузить last_schedule.json
-        last_schedule_file = os.path.join(SCHEDULES_DIR, 'last_schedule.json')
-        if os.path.exists(last_schedule_file):
+        last_schedule_file = os.path.join(get_schedules_dir(source_name), 'last_schedule.json')
+        try:
+            key = file_key(last_schedule_file)
+        except FileNotFoundError:
+            key = None
+        
+        if key:
+            cached = schedule_cache.get(last_schedule_file)
+            if cached and cached[0] == key:
+                return cached[1]
+            
             with open(last_schedule_file, 'r', encoding='utf-8') as f:
                 schedule_data = json.load(f)
-                return {
-                    'update_time': datetime.now().strftime("%d.%m.%Y %H:%M"),
-                    'schedule': schedule_data,
-                    'hash': hashlib.md5(json.dumps(schedule_data, sort_keys=True).encode('utf-8')).hexdigest()
-                }
+            data = {
+                'update_time': datetime.fromtimestamp(key[0] / 1e9).strftime("%d.%m.%Y %H:%M"),
+                'schedule': schedule_data,
+                'hash': hashlib.md5(json.dumps(schedule_data, sort_keys=True).encode('utf-8')).hexdigest()
+            }
+            schedule_cache[last_schedule_file] = (key, data)
+            return data
         
         # Если файла нет, запускаем парсер
         from parser import get_schedule
-        update_time, new_schedule = get_schedule()
+        source = find_source(load_config(), source_name)
+        if not source:
+            return None
+        update_time, new_schedule = get_schedule(source=source)
         
         if new_schedule:
             # Сохраняем новое расписание
-            schedule_hash = save_schedule(update_time, new_schedule)
+            schedule_hash = save_schedule(update_time, new_schedule, source['name'])
             return {
                 'update_time': update_time,
                 'schedule': new_schedule,
@@ -120,109 +227,59 @@ def get_latest_schedule():
     
     return None
 
-def load_user_data(user_id):
-    """Загружает данные пользователя из его файла"""
-    user_file = os.path.join(USERS_DIR, f"{user_id}.json")
-    if os.path.exists(user_file):
-        with open(user_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return None
-
-def save_user_data(user_id, data):
-    """Сохраняет данные пользователя в его файл"""
-    user_file = os.path.join(USERS_DIR, f"{user_id}.json")
-    with open(user_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-def update_user_data(user_id, new_data):
-    """Обновляет данные пользователя с гарантированным сохранением идентификаторов"""
-    try:
-        # Загрузка существующих данных или создание новых
-        user_file = os.path.join(USERS_DIR, f"{user_id}.json")
-        if os.path.exists(user_file):
-            with open(user_file, 'r', encoding='utf-8') as f:
-                current_data = json.load(f)
-        else:
-            current_data = {
-                'user_id': user_id,
-                'username': str(user_id),
-                'first_seen': datetime.now().isoformat(),
-                'last_seen': datetime.now().isoformat(),
-                'notifications': False,
-                'actions': [],
-                'chat_id': None,
-                'banned': False,
-                'ban_reason': None
-            }
-
-        # Обновление данных с сохранением критичных полей
-        for key, value in new_data.items():
-            # Особые правила для ключевых полей
-            if key == 'chat_id' and value is not None:
-                current_data[key] = value
-            elif key == 'user_id':
-                continue  # Никогда не перезаписываем user_id из new_data
-            else:
-                current_data[key] = value
-
-        # Гарантируем что user_id всегда правильный
-        current_data['user_id'] = user_id
-
-        # Сохранение обновленных данных
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(current_data, f, ensure_ascii=False, indent=4)
-
-        return current_data
-    except Exception as e:
-        logger.error(f"Ошибка обновления данных пользователя {user_id}: {str(e)}")
-        return None
+async def load_latest_schedule(source_name=None):
+    """get_latest_schedule в пуле потоков; одновременные вызовы для группы выполняются один раз"""
+    return await schedule_loads.run(source_name, storage.run, get_latest_schedule, source_name)
 
 def log_user_activity(user_id, username, action, chat_id=None):
-    """Логирует активность пользователя с сохранением идентификаторов"""
+    """Логирует активность пользователя; запись в базу выполняется пачками"""
     try:
-        # Подготовка данных для обновления
-        update_data = {
-            'username': username,
-            'last_seen': datetime.now().isoformat()
-        }
-
-        # Добавляем chat_id если он предоставлен
-        if chat_id is not None:
-            update_data['chat_id'] = chat_id
-
-        # Получаем текущие данные пользователя
-        user_data = update_user_data(user_id, update_data)
-        if not user_data:
-            raise Exception("Не удалось обновить данные пользователя")
-
-        # Добавляем запись в историю действий
-        if 'actions' not in user_data:
-            user_data['actions'] = []
-
-        user_data['actions'].append({
-            'time': datetime.now().isoformat(),
-            'action': action,
-            'chat_id': chat_id,  # Сохраняем chat_id для каждого действия
-            'user_id': user_id   # И user_id для дублирования
-        })
-
-        # Сохраняем обновленные данные
-        user_file = os.path.join(USERS_DIR, f"{user_id}.json")
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(user_data, f, ensure_ascii=False, indent=4)
-
+        activity_buffer.record(user_id, username, action, chat_id)
     except Exception as e:
         logger.error(f"Ошибка логирования активности для {user_id}: {str(e)}")
 
+async def flush_user_activity(context: CallbackContext):
+    """Периодическая запись накопленной активности пользователей"""
+    await storage.run(activity_buffer.flush)
+
+async def refresh_user_flags(context: CallbackContext):
+    """Периодически подтягивает изменения флагов из других процессов (баны из админ-панели)"""
+    await storage.run(get_user_flags().refresh)
+
 def is_user_banned(user_id):
-    """Проверяет, заблокирован ли пользователь"""
-    user_data = load_user_data(user_id)
-    return user_data.get('banned', False) if user_data else False
+    """Проверяет, заблокирован ли пользователь (по кешу флагов, без чтения профиля)"""
+    return get_user_flags().is_banned(user_id)
+
+async def send_limited(bot, chat_id, text, attempts=MAX_SEND_ATTEMPTS, before_send=None, **kwargs):
+    """
+    Отправка сообщения с учетом общего лимита исходящих (бот и админ-панель).
+    При RetryAfter пауза сохраняется для всех отправителей, и отправка повторяется
+    (всего attempts попыток, затем RetryAfter пробрасывается).
+    before_send - корутина без аргументов, которая ждется после ожидания лимита
+    непосредственно перед каждым запросом к Telegram.
+    """
+    limiter = get_outbound_limiter()
+    for attempt in range(attempts):
+        # Сначала очередь чата, затем место в общем лимите
+        delay = await storage.run(limiter.reserve_chat, chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        delay = await storage.run(limiter.reserve_global)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if before_send is not None:
+            await before_send()
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            await storage.run(limiter.penalize, chat_id, e.retry_after)
+            if attempt == attempts - 1:
+                raise
 
 async def send_ban_notification(user_id, reason, is_banned=True):
     """Отправляет уведомление о блокировке/разблокировке"""
     try:
-        user_data = load_user_data(user_id)
+        user_data = await storage.run(load_user_data, user_id)
         if not user_data or not user_data.get('chat_id'):
             logger.warning(f"Не удалось отправить уведомление пользователю {user_id}: chat_id не найден или пользователь не существует.")
             return
@@ -240,48 +297,39 @@ async def send_ban_notification(user_id, reason, is_banned=True):
             else:
                 message = "✅ Ваша блокировка в боте снята!"
 
-            await bot.send_message(
-                chat_id=user_data['chat_id'],
-                text=message
-            )
+            await send_limited(bot, user_data['chat_id'], message)
             logger.info(f"Уведомление о {'блокировке' if is_banned else 'разблокировке'} отправлено пользователю {user_id}")
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
             if "bot was blocked" in str(e).lower():
-                update_user_data(user_id, {'notifications': False})
+                await storage.run(update_user_data, user_id, {'notifications': False})
                 logger.info(f"Уведомления для пользователя {user_id} отключены, так как бот был заблокирован.")
     except Exception as e:
         logger.error(f"Критическая ошибка в send_ban_notification: {e}")
 
-def anti_spam(func):
-    """Декоратор для защиты от спама"""
-    async def wrapper(update, context):
-        user_id = update.effective_user.id
-        
-        if is_user_banned(user_id):
-            await update.message.reply_text("🚫 Вы заблокированы в этом боте.")
-            return
+def anti_spam(command=DEFAULT_LIMIT):
+    """Декоратор для защиты от спама; command - ключ лимита в rate_limits"""
+    def decorator(func):
+        async def wrapper(update, context):
+            user_id = update.effective_user.id
             
-        now = datetime.now()
-        
-        if user_id not in user_requests:
-            user_requests[user_id] = []
-        
-        user_requests[user_id] = [
-            t for t in user_requests[user_id] 
-            if now - t < timedelta(seconds=10)
-        ]
-        
-        if len(user_requests[user_id]) >= 15:
-            await update.message.reply_text("⚠️ Слишком много запросов. Подождите 10 секунд.")
-            return
-        
-        user_requests[user_id].append(now)
-        return await func(update, context)
-    return wrapper
+            if is_user_banned(user_id):
+                await update.message.reply_text("🚫 Вы заблокированы в этом боте.")
+                return
+            
+            retry_after = rate_limiter.acquire(user_id, command)
+            if retry_after:
+                await update.message.reply_text(
+                    f"⚠️ Слишком много запросов. Подождите {max(1, round(retry_after))} сек."
+                )
+                return
+            
+            return await func(update, context)
+        return wrapper
+    return decorator
 
 
-@anti_spam
+@anti_spam('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команды /start с инициализацией состояния"""
     user = update.effective_user
@@ -292,7 +340,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_states[user.id] = {"notifications_active": False}
     
     # Загрузка состояния уведомлений из базы
-    user_data = load_user_data(user.id)
+    user_data = await storage.run(load_user_data, user.id)
     if user_data and 'notifications' in user_data:
         user_states[user.id]["notifications_active"] = user_data['notifications']
     
@@ -312,56 +360,187 @@ def create_keyboard(notifications_active=False):
     ]
     return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
 
-@anti_spam
+def render_day(date, day_data):
+    """Текст одного дня расписания"""
+    lines = [f"📅 {date} ({day_data.get('day_of_week', '')}):"]
+    for lesson in day_data["lessons"]:
+        if lesson.get("name") == "Свободно":
+            lines.append(f"🔢 {lesson.get('lesson_number', '?')}: Нет пары")
+        else:
+            subgroup = f" (Подгруппа {lesson['subgroup']})" if lesson.get("subgroup") else ""
+            lines.append(
+                f"🔢 {lesson.get('lesson_number', '?')}: "
+                f"{lesson.get('name', 'Неизвестно')} - "
+                f"{lesson.get('auditorium', '')} "
+                f"(👨‍🏫 {lesson.get('teacher', '')}){subgroup}"
+            )
+    return "\n".join(lines) + "\n\n"
+
+def split_long_line(line, max_length):
+    """Делит строку на куски не длиннее max_length единиц UTF-16, не разрывая символы"""
+    chunks = []
+    current = ""
+    current_length = 0
+    for char in line:
+        char_length = message_length(char)
+        if current_length + char_length > max_length:
+            chunks.append(current)
+            current = ""
+            current_length = 0
+        current += char
+        current_length += char_length
+    chunks.append(current)
+    return chunks
+
+def split_message(blocks, header="", max_length=MAX_MESSAGE_LENGTH):
+    """
+    Собирает блоки в сообщения не длиннее max_length, не разрывая блоки.
+    Блок, который сам не помещается в сообщение, делится по строкам,
+    а слишком длинная строка - на куски.
+    """
+    parts = []
+    current = header
+    for block in blocks:
+        if message_length(current + block) <= max_length:
+            current += block
+            continue
+        if current.strip():
+            parts.append(current)
+            current = ""
+        if message_length(block) <= max_length:
+            current = block
+            continue
+        for line in block.splitlines(keepends=True):
+            if message_length(current + line) > max_length and current:
+                parts.append(current)
+                current = ""
+            if message_length(line) <= max_length:
+                current += line
+                continue
+            chunks = split_long_line(line, max_length)
+            parts.extend(chunks[:-1])
+            current = chunks[-1]
+    if current.strip():
+        parts.append(current)
+    return parts
+
+def get_schedule_messages(data, header=""):
+    """
+    Возвращает готовые сообщения с расписанием, разбитые по дням под лимит Telegram.
+    Результат зависит только от версии расписания, поэтому кешируется по хешу.
+    """
+    key = (data.get('hash'), header)
+    parts = rendered_schedule_cache.get(key)
+    if parts is None:
+        blocks = [render_day(date, day_data) for date, day_data in data["schedule"].items()]
+        parts = split_message(blocks, header)
+        rendered_schedule_cache[key] = parts
+        while len(rendered_schedule_cache) > RENDERED_CACHE_SIZE:
+            rendered_schedule_cache.popitem(last=False)
+    else:
+        rendered_schedule_cache.move_to_end(key)
+    return parts
+
+@anti_spam('check')
 async def show_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отображение расписания с кнопкой обновления"""
+    """Отображение расписания групп, на которые подписан пользователь"""
     user = update.effective_user
     chat = update.effective_chat
     
     log_user_activity(user.id, user.username or str(user.id), "schedule_request", chat.id)
     
-    data = get_latest_schedule()
-    if not data or 'schedule' not in data:
+    current_state = user_states.get(user.id, {}).get("notifications_active", False)
+    sources = get_sources(load_config())
+    groups = user_groups(await storage.run(load_user_data, user.id), sources)
+    if not groups:
         await update.message.reply_text(
-            "⚠️ Не удалось загрузить расписание. Попробуйте позже.",
-            reply_markup=create_keyboard(user_states.get(user.id, {}).get("notifications_active", False))
-        )  # Закрывающая скобка была пропущена
+            "⚠️ Вы не подписаны ни на одну группу. Используйте /groups",
+            reply_markup=create_keyboard(current_state)
+        )
         return
     
-    response = f"🕒 Расписание обновлено: {data.get('update_time', 'неизвестно')}\n\n"
-    
-    for date, day_data in data["schedule"].items():
-        day_of_week = day_data.get("day_of_week", "")
-        response += f"📅 {date} ({day_of_week}):\n"
+    for group in groups:
+        # При смене файла или его отсутствии здесь чтение с диска или загрузка с сайта
+        data = await load_latest_schedule(group)
+        if not data or 'schedule' not in data:
+            await update.message.reply_text(
+                "⚠️ Не удалось загрузить расписание. Попробуйте позже.",
+                reply_markup=create_keyboard(current_state)
+            )
+            continue
         
-        for lesson in day_data["lessons"]:
-            if lesson.get("name") == "Свободно":
-                response += f"🔢 {lesson.get('lesson_number', '?')}: Нет пары\n"
-            else:
-                subgroup = f" (Подгруппа {lesson['subgroup']})" if lesson.get("subgroup") else ""
-                response += (
-                    f"🔢 {lesson.get('lesson_number', '?')}: "
-                    f"{lesson.get('name', 'Неизвестно')} - "
-                    f"{lesson.get('auditorium', '')} "
-                    f"(👨‍🏫 {lesson.get('teacher', '')}){subgroup}\n"
+        header = f"👥 Группа: {group}\n" if len(sources) > 1 else ""
+        header += f"🕒 Расписание обновлено: {data.get('update_time', 'неизвестно')}\n\n"
+        
+        try:
+            # Отправляем готовые части расписания с текущей клавиатурой
+            for part in get_schedule_messages(data, header):
+                await update.message.reply_text(
+                    part,
+                    reply_markup=create_keyboard(current_state)
                 )
-        response += "\n"
+        except Exception as e:
+            logger.error(f"Ошибка отправки расписания: {e}")
+            await update.message.reply_text(
+                "⚠️ Произошла ошибка при формировании расписания",
+                reply_markup=create_keyboard(current_state)
+            )
+
+@anti_spam('groups')
+async def list_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список групп и подписок пользователя (/groups)"""
+    user = update.effective_user
+    log_user_activity(user.id, user.username or str(user.id), "groups_list", update.effective_chat.id)
     
-    try:
-        # Отправляем расписание с текущей клавиатурой
-        current_state = user_states.get(user.id, {}).get("notifications_active", False)
-        await update.message.reply_text(
-            response,
-            reply_markup=create_keyboard(current_state)
-        )
-    except Exception as e:
-        logger.error(f"Ошибка отправки расписания: {e}")
-        await update.message.reply_text(
-            "⚠️ Произошла ошибка при формировании расписания",
-            reply_markup=create_keyboard(user_states.get(user.id, {}).get("notifications_active", False))
-        )
+    sources = get_sources(load_config())
+    if not sources:
+        await update.message.reply_text("⚠️ Группы не настроены")
+        return
+    
+    groups = user_groups(await storage.run(load_user_data, user.id), sources)
+    lines = [f"{'✅' if source['name'] in groups else '▫️'} {source['name']}" for source in sources]
+    await update.message.reply_text(
+        "👥 Группы:\n" + "\n".join(lines) +
+        "\n\nПодписаться или отписаться: /group <название>"
+    )
+
+def toggle_user_group(user_id, name, sources):
+    """Подписывает пользователя на группу или отписывает от неё; возвращает True, если подписан"""
+    result = {}
+    def toggle(user_data):
+        groups = user_groups(user_data, sources)
+        if name in groups:
+            groups.remove(name)
+        else:
+            groups.append(name)
+        user_data['groups'] = groups
+        user_data['user_id'] = user_id
+        result['subscribed'] = name in groups
+    modify_user_data(user_id, toggle)
+    return result['subscribed']
 
-@anti_spam
+@anti_spam('group')
+async def toggle_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подписка на группу или отписка от неё (/group <название>)"""
+    user = update.effective_user
+    chat = update.effective_chat
+    
+    sources = get_sources(load_config())
+    name = " ".join(context.args or []).strip()
+    if not name or name not in [source['name'] for source in sources]:
+        await update.message.reply_text("⚠️ Укажите название группы из списка /groups")
+        return
+    
+    subscribed = await storage.run_for_user(user.id, toggle_user_group, user.id, name, sources)
+    if subscribed:
+        reply = f"🔔 Вы подписались на группу {name}"
+    else:
+        reply = f"🔕 Вы отписались от группы {name}"
+    
+    log_user_activity(user.id, user.username or str(user.id), f"group_toggle_{name}", chat.id)
+    await update.message.reply_text(reply)
+
+@anti_spam('notif')
 async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Переключение уведомлений через команду /notif"""
     user = update.effective_user
@@ -375,7 +554,7 @@ async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYP
     new_state = user_states[user.id]["notifications_active"]
     
     # Сохраняем в базу
-    update_user_data(user.id, {'notifications': new_state})
+    await storage.run_for_user(user.id, update_user_data, user.id, {'notifications': new_state})
     log_user_activity(user.id, user.username or str(user.id), 
                      f"notifications_{'on' if new_state else 'off'}", chat.id)
     
@@ -384,7 +563,7 @@ async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYP
         reply_markup=create_keyboard(new_state)
     )
 
-@anti_spam
+@anti_spam('info')
 async def bot_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Информация о боте"""
     user_id = update.effective_user.id
@@ -396,11 +575,12 @@ async def bot_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📝 Команды:\n"
         "/start - Главное меню\n"
         "/check - Показать расписание\n"
-        "/notif - Переключить уведомления\n\n"
+        "/notif - Переключить уведомления\n"
+        "/groups - Группы и подписки\n\n"
         "🔔 При изменениях в расписании я пришлю уведомление!"
     )
 
-@anti_spam
+@anti_spam('message')
 async def handle_any_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает все входящие сообщения"""
     try:
@@ -443,7 +623,7 @@ async def handle_any_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
         except:
             pass
 
-@anti_spam
+@anti_spam('button')
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений и кнопок"""
     user = update.effective_user
@@ -462,7 +642,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif message_text.startswith("🔔 Уведомления: Вкл"):
         user_states[user.id]["notifications_active"] = False
-        update_user_data(user.id, {'notifications': False})
+        await storage.run_for_user(user.id, update_user_data, user.id, {'notifications': False})
         await update.message.reply_text(
             "Уведомления отключены",
             reply_markup=create_keyboard(False)
@@ -470,7 +650,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif message_text.startswith("🔕 Уведомления: Выкл"):
         user_states[user.id]["notifications_active"] = True
-        update_user_data(user.id, {'notifications': True})
+        await storage.run_for_user(user.id, update_user_data, user.id, {'notifications': True})
         await update.message.reply_text(
             "Уведомления включены",
             reply_markup=create_keyboard(True)
@@ -485,81 +665,233 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=create_keyboard(user_states[user.id]["notifications_active"])
         )
 
-async def send_notifications(context: CallbackContext, message):
-    """Отправка уведомлений пользователям с включенными уведомлениями"""
+async def send_notifications(context: CallbackContext, message, group=None):
+    """
+    Ставит уведомление подписчикам group в очередь рассылки (outbox) и запускает ее отправку.
+    Получатели фиксируются в базе сразу, поэтому перезапуск бота не теряет рассылку.
+    """
     try:
-        success = 0
-        failed = 0
-        
-        for filename in os.listdir(USERS_DIR):
-            if filename.endswith('.json'):
-                user_id = filename[:-5]
-                with open(os.path.join(USERS_DIR, filename), 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-                
-                # Пропускаем заблокированных пользователей
-                if user_data.get('banned', False):
-                    continue
-                    
-                # Проверяем, что уведомления включены и есть chat_id
-                if user_data.get('notifications', False) and user_data.get('chat_id'):
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_data['chat_id'],
-                            text=message
-                        )
-                        success += 1
-                    except Exception as e:
-                        failed += 1
-                        logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-                        # Если бот заблокирован, отключаем уведомления
-                        if "bot was blocked" in str(e).lower():
-                            update_user_data(user_id, {'notifications': False})
-                            logger.info(f"Уведомления для пользователя {user_id} отключены (бот заблокирован)")
-        
-        logger.info(f"Уведомления отправлены: успешно {success}, ошибок {failed}")
-        
+        sources = get_sources(load_config())
+        default_group = sources[0]['name'] if sources else None
+        job_id, count = await storage.run(outbox.enqueue, message, group, default_group)
+        logger.info(f"Рассылка {job_id}{f' (группа {group})' if group else ''}: получателей {count}")
+        ensure_outbox_drain(context.bot)
     except Exception as e:
         logger.error(f"Критическая ошибка при отправке уведомлений: {e}")
 
-async def check_schedule_changes(context: CallbackContext):
-    """Проверка изменений в расписании и отправка уведомлений"""
-    try:
-        config = load_config()
-        interval = config.get('check_interval', 300)  # По умолчанию 5 минут
+def ensure_outbox_drain(bot):
+    """Запускает отправку очереди рассылок, если она еще не идет"""
+    global outbox_task
+    outbox_wakeup.set()
+    if outbox_task is None or outbox_task.done():
+        outbox_task = asyncio.create_task(drain_outbox(bot))
+
+async def drain_outbox(bot):
+    """
+    Отправляет задания из outbox пачками по outbox_batch получателей, пока они есть.
+    Получатель помечается sending прямо перед отправкой, а итог записывается сразу после нее,
+    поэтому при остановке бота неизвестной остается доставка не больше
+    notification_concurrency сообщений, а остальные получатели продолжаются после запуска.
+    """
+    config = load_config() or {}
+    concurrency = config.get('notification_concurrency', DEFAULT_FANOUT_CONCURRENCY)
+    batch_size = max(1, int(config.get('outbox_batch', DEFAULT_OUTBOX_BATCH)))
+    job_stats = {}  # {job_id: FanOutStats} для заданий, начатых этим процессом
+    
+    while True:
+        outbox_wakeup.clear()
+        try:
+            batch = await storage.run(outbox.next_batch, batch_size)
+        except Exception as e:
+            logger.error(f"Ошибка чтения очереди рассылок: {e}")
+            return
+        if batch is None:
+            if outbox_wakeup.is_set():
+                continue
+            return
         
-        # Получаем текущее расписание с сайта
-        from parser import get_schedule
-        update_time, new_schedule = get_schedule()
+        job_id, message, recipients = batch
+        stats = job_stats.setdefault(job_id, FanOutStats())
         
-        if not new_schedule:
-            logger.error("Не удалось получить новое расписание с сайта")
-            return
+        async def record(user_id, status, error=None):
+            try:
+                await storage.run(outbox.record, job_id, user_id, status, error)
+            except Exception as e:
+                logger.error(f"Ошибка записи итога рассылки {job_id} для {user_id}: {e}")
+        
+        async def send(recipient):
+            user_id, chat_id = recipient
+            
+            async def mark_sending():
+                await storage.run(outbox.start, job_id, user_id)
             
-        # Вычисляем хеш нового расписания
-        new_hash = hashlib.md5(json.dumps(new_schedule, sort_keys=True).encode('utf-8')).hexdigest()
+            # sending ставится после ожидания лимита: если бот остановится во время ожидания,
+            # получатель останется pending и получит сообщение после запуска.
+            # RetryAfter повторяет fan_out, поэтому здесь одна попытка
+            try:
+                await send_limited(bot, chat_id, message, attempts=1, before_send=mark_sending)
+            except RetryAfter:
+                # Telegram не принял сообщение - до повтора получатель снова ждет отправки
+                await record(user_id, outbox.PENDING)
+                raise
+            await record(user_id, outbox.SENT)
         
-        # Получаем последнее сохраненное расписание
-        old_data = get_latest_schedule()
-        old_hash = old_data.get('hash') if old_data else None
+        async def on_error(recipient, e):
+            user_id = recipient[0]
+            await record(user_id, outbox.FAILED, f"{type(e).__name__}: {e}")
+            logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+            # Если бот заблокирован, отключаем уведомления
+            if "bot was blocked" in str(e).lower():
+                await storage.run_for_user(user_id, update_user_data, user_id, {'notifications': False})
+                logger.info(f"Уведомления для пользователя {user_id} отключены (бот заблокирован)")
+        
+        await fan_out(recipients, send, concurrency, on_error, stats)
+        counts = await storage.run(outbox.finish, job_id)
+        
+        if counts is not None:
+            stats.finish()
+            job_stats.pop(job_id, None)
+            logger.info(f"Рассылка {job_id} завершена: {stats.summary()}; по статусам {counts}")
+
+def get_parse_pool():
+    """Возвращает пул процессов для парсинга или None, если платформа их не поддерживает"""
+    global parse_pool
+    if parse_pool is None:
+        try:
+            workers = max(1, int((load_config() or {}).get('parse_workers', 1)))
+            # spawn: дочерний процесс не наследует потоки и блокировки работающего бота
+            parse_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        except (ImportError, NotImplementedError, OSError) as e:
+            logger.warning(f"Пул процессов недоступен, парсинг будет выполняться в потоке: {e}")
+            parse_pool = False
+    return parse_pool or None
+
+async def parse_schedule_off_loop(html_content, engine):
+    """Парсит страницу расписания в пуле процессов, не блокируя цикл событий"""
+    global parse_pool
+    from parser import parse_schedule_page
+    pool = get_parse_pool()
+    if pool:
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(pool, parse_schedule_page, html_content, engine)
+        except BrokenProcessPool as e:
+            logger.error(f"Пул процессов парсинга аварийно завершился, пересоздаем: {e}")
+            parse_pool = None
+    return await asyncio.to_thread(parse_schedule_page, html_content, engine)
+
+async def measure_loop_lag(stop_event, interval=0.05):
+    """
+    Замеряет максимальную задержку цикла событий, пока не установлен stop_event.
+    Это время, на которое задерживается ответ любому обработчику команд.
+    """
+    loop = asyncio.get_running_loop()
+    max_lag = 0.0
+    while not stop_event.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, loop.time() - started - interval)
+    return max_lag
+
+async def check_source_changes(context: CallbackContext, source, semaphore, multiple_sources=False):
+    """Проверяет изменения расписания одного источника. Возвращает True, если проверка прошла"""
+    from parser import fetch_schedule_page, commit_fetch_state, NOT_MODIFIED
+    name = source['name']
+    group_label = f" группы {name}" if multiple_sources else ""
+    
+    try:
+        async with semaphore:
+            # Получаем последнее сохраненное расписание
+            old_data = await load_latest_schedule(name)
+            old_hash = old_data.get('hash') if old_data else None
+            
+            # Загружаем страницу с сайта в потоке (условный запрос относительно old_hash)
+            update_time, html_content, fetch_state = await asyncio.to_thread(
+                fetch_schedule_page, old_hash, source
+            )
+        
+        if html_content is NOT_MODIFIED:
+            new_hash = old_hash
+        else:
+            # Парсим в отдельном процессе, чтобы обработчики команд не ждали
+            new_schedule = await parse_schedule_off_loop(html_content, fetch_state['engine'])
+            await asyncio.to_thread(commit_fetch_state, fetch_state, new_schedule)
+            
+            # Вычисляем хеш нового расписания
+            new_hash = hashlib.md5(json.dumps(new_schedule, sort_keys=True).encode('utf-8')).hexdigest()
         
         if old_hash != new_hash:
-            logger.info(f"Обнаружены изменения в расписании (интервал проверки: {interval} сек)")
+            # Сохраняем новое расписание и сравниваем его с прежним по дням и парам
+            diff = await asyncio.to_thread(save_schedule_with_diff, update_time, new_schedule, old_data, name)
+            logger.info(
+                f"Обнаружены изменения в расписании{group_label}: "
+                f"добавлено дней {len(diff['added_days'])}, удалено {len(diff['removed_days'])}, "
+                f"изменено {len(diff['changed_days'])}"
+            )
             
-            # Сохраняем новое расписание
-            save_schedule(update_time, new_schedule)
+            diff = significant_changes(diff)
+            if not has_changes(diff):
+                logger.info(f"Изменения{group_label} касаются только прошедших дней, уведомления не отправляются")
+                return True
             
-            # Формируем сообщение об изменениях
-            message = (
-                "🔄 Расписание обновлено!\n"
-                f"Дата обновления: {update_time}\n"
-                "Используйте команду /check чтобы посмотреть изменения"
+            # Формируем сообщение с изменившимися днями
+            message = format_diff(
+                diff,
+                header=f"🔄 Расписание{group_label} обновлено!\nДата обновления: {update_time}\n\n",
+                footer="Полное расписание: /check"
             )
             
-            # Отправляем уведомления пользователям с включенными уведомлениями
-            await send_notifications(context, message)
+            # Уведомляем только подписчиков этой группы
+            await send_notifications(context, message, name)
         else:
-            logger.info(f"Изменений в расписании не обнаружено (интервал проверки: {interval} сек)")
+            logger.info(f"Изменений в расписании{group_label} не обнаружено")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Ошибка при проверке расписания{group_label}: {e}")
+        return False
+
+async def check_schedule_changes(context: CallbackContext):
+    """Проверка изменений в расписании всех групп и отправка уведомлений"""
+    try:
+        config = load_config()
+        interval = config.get('check_interval', 300)  # По умолчанию 5 минут
+        
+        sources = get_sources(config)
+        if not sources:
+            raise Exception("В конфигурации не задан ни один источник расписания")
+        
+        # Источники загружаются параллельно, но не больше max_concurrent_fetches одновременно
+        max_concurrent = max(1, int(config.get('max_concurrent_fetches', DEFAULT_MAX_CONCURRENT_FETCHES)))
+        semaphore = asyncio.Semaphore(max_concurrent)
+        
+        # Замеряем, насколько проверка задерживает обработку команд пользователей
+        lag_stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(lag_stop))
+        started = datetime.now()
+        try:
+            results = await asyncio.gather(*(
+                check_source_changes(context, source, semaphore, len(sources) > 1)
+                for source in sources
+            ))
+        finally:
+            lag_stop.set()
+            max_lag = await lag_task
+        logger.info(
+            f"Проверка заняла {(datetime.now() - started).total_seconds():.2f} сек, "
+            f"максимальная задержка цикла событий: {max_lag * 1000:.1f} мс"
+        )
+        # Счетчики с запуска: сколько повторных загрузок расписания удалось не выполнять
+        logger.info(f"Загрузки расписания: {schedule_loads.summary()}")
+        
+        failed = results.count(False)
+        if failed:
+            raise Exception(f"Не удалось проверить {failed} из {len(sources)} источников")
+        
+        logger.info(f"Проверка расписания завершена (источников: {len(sources)}, интервал проверки: {interval} сек)")
         
         # Планируем следующую проверку
         context.job_queue.run_once(
@@ -583,14 +915,23 @@ async def shutdown_application():
     if application:
         try:
             logger.info("Завершение работы бота...")
+            if outbox_task and not outbox_task.done():
+                # Итог текущей пачки записывается, остальное отправится после запуска
+                outbox_task.cancel()
+                await asyncio.gather(outbox_task, return_exceptions=True)
             if application.updater:
                 await application.updater.stop()
             await application.stop()
             await application.shutdown()
+            if parse_pool:
+                parse_pool.shutdown(wait=False, cancel_futures=True)
             logger.info("Бот корректно завершил работу")
         except Exception as e:
             logger.error(f"Ошибка при завершении работы: {e}")
         finally:
+            # Обработчики остановлены - дописываем оставшуюся активность
+            storage.shutdown(wait=True)
+            activity_buffer.flush()
             application = None
 
 async def main():
@@ -618,6 +959,8 @@ async def main():
         application.add_handler(CommandHandler("check", show_schedule))
         application.add_handler(CommandHandler("info", bot_info))
         application.add_handler(CommandHandler("notif", toggle_notifications))
+        application.add_handler(CommandHandler("groups", list_groups))
+        application.add_handler(CommandHandler("group", toggle_group))
         
         # Основной обработчик текстовых сообщений
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -630,12 +973,49 @@ async def main():
         
         application.job_queue.run_once(check_schedule_changes, check_interval, name="schedule_check")
         
+        storage.max_workers = max(1, int(config.get('storage_workers', DEFAULT_STORAGE_WORKERS)))
+        
+        # Лимиты запросов по командам (rate_limits в config.json)
+        rate_limiter.max_buckets = max(1, int(config.get('rate_limit_max_buckets', DEFAULT_MAX_BUCKETS)))
+        rate_limiter.configure(config.get('rate_limits'))
+        
+        # Общий с админ-панелью лимит исходящих сообщений Telegram
+        get_outbound_limiter(config)
+        
+        # Кеш флагов пользователей; баны из админ-панели подхватываются не позже чем через user_flags_refresh
+        user_flags = get_user_flags()
+        user_flags.refresh_interval = config.get('user_flags_refresh', DEFAULT_FLAGS_REFRESH)
+        user_flags.load()
+        application.job_queue.run_repeating(
+            refresh_user_flags,
+            user_flags.refresh_interval,
+            name="user_flags_refresh"
+        )
+        check_subscriptions()
+        
+        # Журнал действий: перенос старых массивов actions из профилей
+        get_activity_log(config)
+        
+        # Запись активности пользователей пачками
+        activity_buffer.flush_size = max(1, int(config.get('activity_flush_size', DEFAULT_FLUSH_SIZE)))
+        application.job_queue.run_repeating(
+            flush_user_activity,
+            config.get('activity_flush_interval', DEFAULT_FLUSH_INTERVAL),
+            name="activity_flush"
+        )
+        
         logger.info(f"🤖 Бот запускается с интервалом проверки {check_interval} сек...")
         
         await application.initialize()
         await application.start()
         await application.updater.start_polling()
         
+        # Продолжаем рассылки, прерванные остановкой бота
+        pending = outbox.recover(config.get('outbox_keep_days', DEFAULT_OUTBOX_KEEP_DAYS))
+        if pending:
+            logger.info(f"Продолжение прерванных рассылок: осталось получателей {pending}")
+            ensure_outbox_drain(application.bot)
+        
         await shutdown_event.wait()
         
     except InvalidToken:
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Значение по умолчанию для ключа broadcast_concurrency в config.json
+DEFAULT_BROADCAST_CONCURRENCY = 8
+# Как часто частичные итоги рассылки сохраняются в историю сообщений (секунды)
+HISTORY_SAVE_INTERVAL = 1.0
+# Сколько завершенных рассылок доступно через /broadcast_status
+KEEP_FINISHED_JOBS = 20
+
+class BroadcastJob:
+    """Рассылка из админ-панели, выполняемая в фоновом потоке"""
+
+    def __init__(self, message_type, msg_data):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.message_type = message_type
+        self.msg_data = msg_data
+        self.msg_data['job_id'] = self.job_id
+        self.msg_data['status'] = 'in_progress'
+        self.state = 'collecting'  # collecting -> sending -> done | error
+        self.total = None
+        self.success = 0
+        self.failed = 0
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.version = 0
+        self.changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.state in ('done', 'error')
+
+    def _touch(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    def set_state(self, state, total=None, error=None):
+        with self.changed:
+            self.state = state
+            if total is not None:
+                self.total = total
+            if error is not None:
+                self.error = error
+            if self.done:
+                self.finished = time.time()
+            self._touch()
+
+    def add(self, entry):
+        """Добавляет итог отправки одному получателю в msg_data['delivered']"""
+        with self.changed:
+            self.msg_data['delivered'].append(entry)
+            if entry.get('status') == 'success':
+                self.success += 1
+            else:
+                self.failed += 1
+            self._touch()
+
+    def history_copy(self):
+        """Копия msg_data для записи в историю, пока рассылка продолжает ее дополнять"""
+        with self.changed:
+            return dict(self.msg_data, delivered=list(self.msg_data['delivered']))
+
+    def snapshot(self):
+        with self.changed:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            'job_id': self.job_id,
+            'type': self.message_type,
+            'state': self.state,
+            'done': self.done,
+            'total': self.total,
+            'success': self.success,
+            'failed': self.failed,
+            'error': self.error,
+            'elapsed': round((self.finished or time.time()) - self.started, 1),
+        }
+
+    def wait_for_update(self, version, timeout):
+        """Ждет изменений после version (не дольше timeout); возвращает (новая версия, состояние)"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version or self.done, timeout)
+            return self.version, self._snapshot()
+
+_jobs = OrderedDict()  # {job_id: BroadcastJob}
+_jobs_lock = threading.Lock()
+
+def start_broadcast(message_type, msg_data, collect, send, save_history,
+                    concurrency=DEFAULT_BROADCAST_CONCURRENCY):
+    """
+    Запускает рассылку в фоновом потоке и сразу возвращает BroadcastJob.
+    collect() -> (получатели [{'user_id', 'chat_id'}], записи о неудачах для delivered);
+    send(chat_id, text, user_id) -> {'success': bool, 'error': ...};
+    save_history(message_type, msg_data) вызывается по ходу рассылки и в конце.
+    """
+    job = BroadcastJob(message_type, msg_data)
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        finished = [job_id for job_id, other in _jobs.items() if other.done]
+        for job_id in finished[:max(0, len(finished) - KEEP_FINISHED_JOBS)]:
+            del _jobs[job_id]
+    threading.Thread(
+        target=_run, args=(job, collect, send, save_history, max(1, int(concurrency))),
+        name=f"broadcast-{job.job_id}", daemon=True
+    ).start()
+    return job
+
+def get_broadcast(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def _run(job, collect, send, save_history, concurrency):
+    text = job.msg_data['message']
+    try:
+        recipients, failures = collect()
+        for entry in failures:
+            job.add(entry)
+        job.set_state('sending', total=len(recipients) + len(failures))
+        save_history(job.message_type, job.history_copy())
+
+        saved = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='broadcast') as pool:
+            futures = {
+                pool.submit(send, recipient['chat_id'], text, recipient['user_id']): recipient
+                for recipient in recipients
+            }
+            for future in as_completed(futures):
+                recipient = futures[future]
+                entry = {'user_id': recipient['user_id'], 'chat_id': recipient['chat_id']}
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                if result.get('success'):
+                    entry['status'] = 'success'
+                else:
+                    entry.update(status='failed', reason=result.get('error', 'Unknown error'))
+                job.add(entry)
+                if time.monotonic() - saved >= HISTORY_SAVE_INTERVAL:
+                    save_history(job.message_type, job.history_copy())
+                    saved = time.monotonic()
+        state, error = 'done', None
+    except Exception as e:
+        logger.error(f"Ошибка рассылки {job.job_id}: {e}")
+        state, error = 'error', str(e)
+    # История сохраняется до того, как /broadcast_status сообщит о завершении
+    with job.changed:
+        job.msg_data['status'] = state
+    save_history(job.message_type, job.history_copy())
+    job.set_state(state, error=error)
+    logger.info(f"Рассылка {job.job_id} завершена: успешно {job.success}, ошибок {job.failed}")
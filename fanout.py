@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import time
+import asyncio
+import logging
+from collections import Counter
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Значение по умолчанию для ключа notification_concurrency в config.json
+DEFAULT_FANOUT_CONCURRENCY = 16
+# Сколько раз подряд одному получателю можно ответить RetryAfter, прежде чем это станет ошибкой
+MAX_RETRY_AFTER_ROUNDS = 5
+
+class FanOutStats:
+    """Итоги рассылки: успехи, ошибки по типам, ожидания RetryAfter и скорость"""
+
+    def __init__(self):
+        self.success = 0
+        self.failed = 0
+        self.throttled = 0
+        self.errors = Counter()  # {имя класса исключения: количество}
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    def record_error(self, error):
+        self.failed += 1
+        self.errors[type(error).__name__] += 1
+
+    def finish(self):
+        self.duration = time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return (self.success + self.failed) / self.duration if self.duration else 0.0
+
+    def summary(self):
+        errors = ", ".join(f"{name}: {count}" for name, count in self.errors.most_common()) or "нет"
+        return (f"успешно {self.success}, ошибок {self.failed} ({errors}), RetryAfter {self.throttled}, "
+                f"за {self.duration:.1f} с ({self.rate:.1f} сообщ/с)")
+
+async def fan_out(recipients, send, concurrency=DEFAULT_FANOUT_CONCURRENCY, on_error=None, stats=None):
+    """
+    Вызывает await send(получатель) для всех recipients, не более concurrency одновременно.
+    Получатели берутся из итератора по мере освобождения мест, задачи на каждого не создаются.
+    RetryAfter не считается ошибкой: отправка ждет указанное время и повторяется.
+    Для остальных ошибок вызывается await on_error(получатель, исключение). Возвращает FanOutStats;
+    чтобы считать несколько пачек одной рассылкой, передайте общий stats и вызовите stats.finish() в конце.
+    """
+    own_stats = stats is None
+    if own_stats:
+        stats = FanOutStats()
+    pending = iter(recipients)
+
+    async def worker():
+        for recipient in pending:
+            for attempt in range(MAX_RETRY_AFTER_ROUNDS + 1):
+                try:
+                    await send(recipient)
+                    stats.success += 1
+                    break
+                except RetryAfter as e:
+                    stats.throttled += 1
+                    if attempt < MAX_RETRY_AFTER_ROUNDS:
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                    error = e
+                except Exception as e:
+                    error = e
+                stats.record_error(error)
+                if on_error:
+                    try:
+                        await on_error(recipient, error)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки неудачной отправки: {e}")
+                break
+
+    await asyncio.gather(*(worker() for _ in range(max(1, int(concurrency)))))
+    if own_stats:
+        stats.finish()
+    return stats
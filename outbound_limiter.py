@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import time
+import logging
+import threading
+
+from user_repository import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для ключей config.json (сообщений в секунду)
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_CHAT_RATE = 1
+# Сколько раз повторять отправку после ответа 429 (RetryAfter)
+MAX_SEND_ATTEMPTS = 3
+# Как часто удалять записи чатов, лимит которых уже восстановился
+PRUNE_EVERY = 1000
+GLOBAL_KEY = 'global'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_limits (
+    key TEXT PRIMARY KEY,
+    tat REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+class OutboundLimiter:
+    """
+    Общий лимит исходящих сообщений Telegram для бота и админ-панели.
+    Для бота целиком и для каждого чата в базе пользователей хранится момент,
+    раньше которого следующее сообщение отправлять нельзя (GCRA). Сначала бронируется
+    очередь чата, а место в общем лимите - только когда она подошла.
+    Место под отправку бронируется в транзакции BEGIN IMMEDIATE, поэтому
+    процессы не могут вместе превысить лимит. Время - time.time(), общее для процессов.
+    """
+
+    def __init__(self, global_rate=DEFAULT_GLOBAL_RATE, chat_rate=DEFAULT_CHAT_RATE):
+        self.global_interval = 1 / max(0.001, float(global_rate))
+        self.chat_interval = 1 / max(0.001, float(chat_rate))
+        self.reservations = 0
+        get_connection().executescript(SCHEMA)
+
+    @staticmethod
+    def _chat_key(chat_id):
+        return f"chat:{chat_id}"
+
+    def _book(self, keys, interval, prune=False):
+        """
+        Бронирует ближайший момент, когда свободны все keys, и сдвигает их на interval.
+        Возвращает, сколько секунд нужно подождать до этого момента.
+        """
+        connection = get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            placeholders = ', '.join('?' * len(keys))
+            tats = dict(connection.execute(
+                f"SELECT key, tat FROM outbound_limits WHERE key IN ({placeholders})", keys
+            ))
+            slot = max([now] + [tats.get(key, now) for key in keys])
+            connection.executemany(
+                "INSERT OR REPLACE INTO outbound_limits (key, tat) VALUES (?, ?)",
+                [(key, slot + interval) for key in keys]
+            )
+            if prune:
+                connection.execute(
+                    "DELETE FROM outbound_limits WHERE key != ? AND tat < ?", (GLOBAL_KEY, now)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return slot - now
+
+    def reserve_chat(self, chat_id):
+        """
+        Первый шаг отправки: бронирует очередь в chat_id и возвращает, сколько секунд ждать.
+        Общий лимит здесь не трогается, чтобы ожидание одного чата не задерживало остальные.
+        """
+        self.reservations += 1
+        try:
+            return self._book((self._chat_key(chat_id),), self.chat_interval,
+                              prune=self.reservations % PRUNE_EVERY == 0)
+        except Exception as e:
+            # Без базы отправка не блокируется, но и не согласуется с другим процессом
+            logger.error(f"Ошибка лимита исходящих сообщений для чата {chat_id}: {e}")
+            return 0
+
+    def reserve_global(self):
+        """
+        Второй шаг отправки, когда очередь чата подошла: бронирует место в общем лимите
+        и возвращает, сколько секунд ждать.
+        """
+        try:
+            return self._book((GLOBAL_KEY,), self.global_interval)
+        except Exception as e:
+            logger.error(f"Ошибка общего лимита исходящих сообщений: {e}")
+            return 0
+
+    def wait(self, chat_id):
+        """Блокирующее ожидание своей очереди на отправку (для админ-панели)"""
+        delay = self.reserve_chat(chat_id)
+        if delay > 0:
+            time.sleep(delay)
+        delay = self.reserve_global()
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self, chat_id, retry_after):
+        """Telegram ответил RetryAfter: все отправки откладываются на retry_after секунд"""
+        until = time.time() + float(retry_after)
+        try:
+            get_connection().executemany(
+                "INSERT INTO outbound_limits (key, tat) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tat = MAX(tat, excluded.tat)",
+                [(GLOBAL_KEY, until), (self._chat_key(chat_id), until)]
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения RetryAfter для чата {chat_id}: {e}")
+        logger.warning(f"Telegram попросил подождать {retry_after} сек (чат {chat_id})")
+
+_outbound_limiter = None
+_outbound_limiter_lock = threading.Lock()
+
+def get_outbound_limiter(config=None):
+    """Общий ограничитель процесса; лимиты берутся из config.json при первом обращении"""
+    global _outbound_limiter
+    with _outbound_limiter_lock:
+        if _outbound_limiter is None:
+            config = config or {}
+            _outbound_limiter = OutboundLimiter(
+                config.get('outbound_global_rate', DEFAULT_GLOBAL_RATE),
+                config.get('outbound_chat_rate', DEFAULT_CHAT_RATE)
+            )
+        return _outbound_limiter
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import sys
+import logging
+from datetime import datetime, timedelta
+
+import user_repository
+from user_repository import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для ключей config.json
+DEFAULT_OUTBOX_BATCH = 50
+DEFAULT_OUTBOX_KEEP_DAYS = 7
+
+# Состояния доставки одному получателю
+PENDING = 'pending'
+SENDING = 'sending'  # Отправляется прямо сейчас; после перезапуска становится unknown
+SENT = 'sent'
+FAILED = 'failed'
+UNKNOWN = 'unknown'  # Процесс остановился во время отправки: повтор мог бы дать дубль
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    finished TEXT,
+    grp TEXT,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox_deliveries (
+    job_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    PRIMARY KEY (job_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_outbox_deliveries_status ON outbox_deliveries(status, job_id);
+"""
+
+_schema_ready = set()  # Файлы баз, в которых схема уже создана этим процессом
+
+def _connection():
+    connection = get_connection()
+    if user_repository.DB_FILE not in _schema_ready:
+        connection.executescript(SCHEMA)
+        _schema_ready.add(user_repository.DB_FILE)
+    return connection
+
+def _transaction(connection, work):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        result = work()
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return result
+
+def enqueue(message, group=None, default_group=None):
+    """
+    Создает задание рассылки: получатели копируются из индекса подписчиков
+    в той же транзакции, поэтому список фиксируется в момент изменения расписания.
+    Возвращает (job_id, число получателей).
+    """
+    connection = _connection()
+
+    def work():
+        job_id = connection.execute(
+            "INSERT INTO outbox_jobs (created, grp, message) VALUES (?, ?, ?)",
+            (datetime.now().isoformat(), group, message)
+        ).lastrowid
+        if group is None:
+            select = "SELECT ?, user_id, MIN(chat_id), ? FROM subscriptions GROUP BY user_id"
+            params = (job_id, PENDING)
+        else:
+            select = ("SELECT ?, user_id, chat_id, ? FROM subscriptions "
+                      "WHERE grp = ? OR (grp = '' AND ? = ?)")
+            params = (job_id, PENDING, group, group, default_group)
+        count = connection.execute(
+            f"INSERT OR IGNORE INTO outbox_deliveries (job_id, user_id, chat_id, status) {select}", params
+        ).rowcount
+        if not count:
+            connection.execute(
+                "UPDATE outbox_jobs SET finished = ? WHERE job_id = ?", (datetime.now().isoformat(), job_id)
+            )
+        return job_id, count
+
+    return _transaction(connection, work)
+
+def next_batch(limit=DEFAULT_OUTBOX_BATCH):
+    """
+    Возвращает до limit неотправленных получателей самого старого задания, не меняя их статус.
+    Результат (job_id, текст, [(user_id, chat_id)]) или None, если отправлять нечего.
+    """
+    connection = _connection()
+    row = connection.execute(
+        "SELECT job_id FROM outbox_deliveries WHERE status = ? ORDER BY job_id LIMIT 1", (PENDING,)
+    ).fetchone()
+    if row is None:
+        return None
+    job_id = row[0]
+    recipients = connection.execute(
+        "SELECT user_id, chat_id FROM outbox_deliveries WHERE status = ? AND job_id = ? LIMIT ?",
+        (PENDING, job_id, limit)
+    ).fetchall()
+    message = connection.execute("SELECT message FROM outbox_jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+    return job_id, message, recipients
+
+def start(job_id, user_id):
+    """
+    Помечает получателя sending непосредственно перед отправкой ему сообщения.
+    Если процесс остановится до record, после перезапуска доставка станет unknown.
+    """
+    connection = _connection()
+    _transaction(connection, lambda: connection.execute(
+        "UPDATE outbox_deliveries SET status = ? WHERE job_id = ? AND user_id = ? AND status IN (?, ?)",
+        (SENDING, job_id, str(user_id), PENDING, SENDING)
+    ))
+
+def record(job_id, user_id, status, error=None):
+    """Сохраняет итог отправки одному получателю сразу после нее"""
+    connection = _connection()
+    _transaction(connection, lambda: connection.execute(
+        "UPDATE outbox_deliveries SET status = ?, error = ? WHERE job_id = ? AND user_id = ?",
+        (status, error, job_id, str(user_id))
+    ))
+
+def finish(job_id):
+    """
+    Закрывает задание, если в нем не осталось неотправленных,
+    и возвращает счетчики по статусам; иначе возвращает None.
+    """
+    connection = _connection()
+
+    def work():
+        left = connection.execute(
+            "SELECT 1 FROM outbox_deliveries WHERE job_id = ? AND status IN (?, ?) LIMIT 1",
+            (job_id, PENDING, SENDING)
+        ).fetchone()
+        if left:
+            return None
+        connection.execute(
+            "UPDATE outbox_jobs SET finished = ? WHERE job_id = ? AND finished IS NULL",
+            (datetime.now().isoformat(), job_id)
+        )
+        return job_counts(job_id)
+
+    return _transaction(connection, work)
+
+def job_counts(job_id):
+    """Число получателей задания по статусам {статус: количество}"""
+    return dict(_connection().execute(
+        "SELECT status, COUNT(*) FROM outbox_deliveries WHERE job_id = ? GROUP BY status", (job_id,)
+    ))
+
+def recover(keep_days=DEFAULT_OUTBOX_KEEP_DAYS):
+    """
+    Вызывается при запуске бота. Получатели, отправка которым шла в момент остановки,
+    помечаются unknown: сообщение могло уйти, и повтор дал бы дубль.
+    Остальные остаются pending, и рассылка продолжается с них.
+    Задания, где не осталось неотправленных, закрываются; закрытые старше keep_days удаляются.
+    Возвращает число получателей, ожидающих отправки.
+    """
+    connection = _connection()
+    now = datetime.now()
+
+    def work():
+        unknown = connection.execute(
+            "UPDATE outbox_deliveries SET status = ?, error = ? WHERE status = ?",
+            (UNKNOWN, 'interrupted', SENDING)
+        ).rowcount
+        if unknown:
+            logger.warning(f"Рассылка была прервана: доставка {unknown} сообщений неизвестна")
+        connection.execute(
+            "UPDATE outbox_jobs SET finished = ? WHERE finished IS NULL AND NOT EXISTS ("
+            "SELECT 1 FROM outbox_deliveries d WHERE d.job_id = outbox_jobs.job_id AND d.status = ?)",
+            (now.isoformat(), PENDING)
+        )
+        old_jobs = "SELECT job_id FROM outbox_jobs WHERE finished IS NOT NULL AND finished < ?"
+        cutoff = (now - timedelta(days=keep_days)).isoformat()
+        connection.execute(f"DELETE FROM outbox_deliveries WHERE job_id IN ({old_jobs})", (cutoff,))
+        connection.execute(f"DELETE FROM outbox_jobs WHERE job_id IN ({old_jobs})", (cutoff,))
+        return connection.execute(
+            "SELECT COUNT(*) FROM outbox_deliveries WHERE status = ?", (PENDING,)
+        ).fetchone()[0]
+
+    return _transaction(connection, work)
+
+def recent_jobs(limit=20):
+    """Последние задания [(job_id, created, finished, grp, {статус: количество})]"""
+    jobs = _connection().execute(
+        "SELECT job_id, created, finished, grp FROM outbox_jobs ORDER BY job_id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [(*job, job_counts(job[0])) for job in jobs]
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != 'status':
+        print("Использование: python outbox.py status")
+        sys.exit(1)
+    for job_id, created, finished, group, counts in recent_jobs():
+        state = f"завершено {finished}" if finished else "отправляется"
+        print(f"#{job_id} {created} группа {group or 'все'}: {state}; {counts}")
@@ -2,26 +2,61 @@
 import json
 import os
 import hashlib
-import requests
 from datetime import datetime
 from bs4 import BeautifulSoup
 import logging
 
+try:
+    import lxml.html
+except ImportError:  # lxml не установлен - остается только BeautifulSoup
+    lxml = None
+
 # Константы путей
 SCHEDULES_DIR = 'schedules'
 LAST_SCHEDULE_FILE = os.path.join(SCHEDULES_DIR, 'last_schedule.json')
+# Валидаторы HTTP и хеш сырого ответа последней загрузки
+FETCH_STATE_FILE = os.path.join(SCHEDULES_DIR, 'last_schedule.state')
+
+# Возвращается get_schedule вместо данных, если страница не менялась
+NOT_MODIFIED = object()
+
+# Движки парсинга: 'bs4' - исходный на BeautifulSoup, 'lxml' - быстрый однопроходный.
+# lxml включается явно: на битой разметке (например, без </td>) его дерево расходится
+# с html.parser, и смена движка изменила бы хеши уже сохраненных расписаний
+PARSER_ENGINES = ('bs4', 'lxml')
+DEFAULT_PARSER_ENGINE = 'bs4'
+
+# Теги, текст внутри которых BeautifulSoup не включает в get_text()
+_LXML_SKIP_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
 
 # Настройка логирования
 from log_handler import setup_logging
 logger = setup_logging()
 
+from schedule_client import get_client
+from sources import find_source, source_dir
+
 def ensure_schedules_dir():
     """Создает папку для расписаний, если её нет"""
     os.makedirs(SCHEDULES_DIR, exist_ok=True)
 
-def parse_schedule(html_content):
+def parse_schedule(html_content, engine=DEFAULT_PARSER_ENGINE):
     """
     Парсит HTML-контент расписания и возвращает структурированные данные.
+    При ошибке движка lxml используется BeautifulSoup.
+    """
+    if engine == 'lxml' and lxml is not None:
+        try:
+            schedule_data = parse_schedule_lxml(html_content)
+            if "error" not in schedule_data:
+                return schedule_data
+        except Exception as e:
+            logger.warning(f"Ошибка парсинга через lxml, используется BeautifulSoup: {e}")
+    return parse_schedule_bs4(html_content)
+
+def parse_schedule_bs4(html_content):
+    """
+    Парсит HTML-контент расписания через BeautifulSoup (html.parser).
     """
     soup = BeautifulSoup(html_content, 'html.parser')
     schedule_table = soup.find('table', class_='inf')
@@ -122,32 +157,244 @@ def parse_schedule(html_content):
     
     return parsed_schedule
 
-def get_schedule():
+def _lxml_strings(element):
+    """Возвращает текстовые фрагменты элемента в том же порядке, что и BeautifulSoup"""
+    if element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in _LXML_SKIP_TEXT_TAGS:
+            yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
+
+def _lxml_text(element, separator=''):
+    """Аналог get_text(separator=..., strip=True) из BeautifulSoup"""
+    return separator.join(s.strip() for s in _lxml_strings(element) if s.strip())
+
+def _lxml_classes(element):
+    """Список классов элемента"""
+    return element.get('class', '').split()
+
+def parse_schedule_lxml(html_content):
+    """
+    Парсит HTML-контент расписания через lxml за один проход по строкам таблицы.
+    Результат совпадает с parse_schedule_bs4.
+    """
+    root = lxml.html.document_fromstring(html_content)
+    tables = root.xpath(
+        "//table[contains(concat(' ', normalize-space(@class), ' '), ' inf ')]"
+    )
+
+    if not tables:
+        return {"error": "Таблица расписания не найдена."}
+
+    parsed_schedule = {}
+    current_date = None
+    # Номера пар каждого дня - вместо поиска any(...) по списку занятий
+    lesson_numbers = {}
+
+    def add_lesson(lesson):
+        parsed_schedule[current_date]["lessons"].append(lesson)
+        if "lesson_number" in lesson:
+            lesson_numbers[current_date].add(lesson["lesson_number"])
+
+    # Пропускаем первые две строки заголовков таблицы
+    rows = tables[0].xpath('.//tr')[2:]
+
+    for row in rows:
+        cols = row.xpath('.//td')
+
+        # Пропускаем пустые строки-разделители между днями
+        if len(cols) == 1 and 'hd0' in _lxml_classes(cols[0]):
+            continue
+
+        lesson_number_td = None
+        lesson_details_td = None
+
+        # Строка с датой (первая колонка имеет rowspan)
+        if 'rowspan' in cols[0].attrib and 'hd' in _lxml_classes(cols[0]):
+            parts = _lxml_text(cols[0], separator=' ').split()
+            if len(parts) >= 2:
+                current_date = parts[0]
+                parsed_schedule[current_date] = {
+                    "day_of_week": parts[1],
+                    "lessons": []
+                }
+                lesson_numbers[current_date] = set()
+
+            if len(cols) > 1:
+                lesson_number_td = cols[1]
+                lesson_details_td = cols[2] if len(cols) > 2 else None
+        # Последующая строка с парой для текущего дня
+        elif current_date and len(cols) >= 2:
+            lesson_number_td = cols[0]
+            lesson_details_td = cols[1]
+
+        if lesson_number_td is None or lesson_details_td is None:
+            continue
+
+        lesson_number = _lxml_text(lesson_number_td)
+
+        if 'nul' in _lxml_classes(lesson_details_td):
+            add_lesson({
+                "lesson_number": lesson_number,
+                "name": "Свободно",
+                "auditorium": "",
+                "teacher": "",
+                "subgroup": None
+            })
+            continue
+
+        current_lesson_info = {}
+        subgroup_count = 0
+
+        for link in lesson_details_td.iterdescendants('a'):
+            link_classes = _lxml_classes(link)
+            if 'z1' in link_classes:
+                # Начало нового занятия - сохраняем предыдущее
+                if current_lesson_info:
+                    subgroup_count += 1
+                    current_lesson_info["subgroup"] = f"Подгруппа {subgroup_count}" if subgroup_count > 1 else None
+                    add_lesson(current_lesson_info)
+                    current_lesson_info = {}
+
+                current_lesson_info["name"] = _lxml_text(link)
+                current_lesson_info["lesson_number"] = lesson_number
+            elif 'z2' in link_classes:
+                current_lesson_info["auditorium"] = _lxml_text(link)
+            elif 'z3' in link_classes:
+                current_lesson_info["teacher"] = _lxml_text(link)
+
+        if current_lesson_info:
+            subgroup_count += 1
+            current_lesson_info["subgroup"] = f"Подгруппа {subgroup_count}" if subgroup_count > 1 else None
+            add_lesson(current_lesson_info)
+
+        if lesson_number not in lesson_numbers[current_date]:
+            add_lesson({
+                "lesson_number": lesson_number,
+                "name": "Неизвестно",
+                "auditorium": "",
+                "teacher": "",
+                "subgroup": None
+            })
+
+    return parsed_schedule
+
+def load_fetch_state(state_file=FETCH_STATE_FILE):
+    """Загружает состояние последней загрузки страницы (ETag, Last-Modified, хеши)."""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_fetch_state(state, state_file=FETCH_STATE_FILE):
+    """Сохраняет состояние последней загрузки рядом с last_schedule.json."""
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+
+def fetch_schedule_page(known_hash=None, source=None):
+    """
+    Загружает страницу расписания без парсинга.
+    Возвращает кортеж (update_time, html_content, fetch_state); если страница
+    не изменилась, вместо html_content возвращается NOT_MODIFIED.
+    Ошибки не перехватываются.
+    """
+    # Загрузка конфигурации
+    with open('config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    
+    source = source or find_source(config)
+    if not source:
+        raise Exception("В config.json не найден ключ 'site_url' или список 'sources'")
+    site_url = source['url']
+    state_file = os.path.join(source_dir(source['name']), os.path.basename(FETCH_STATE_FILE))
+
+    # Состоянию доверяем, только если оно относится к расписанию вызывающего
+    state = load_fetch_state(state_file) if known_hash else None
+    if state and (state.get('site_url') != site_url or state.get('schedule_hash') != known_hash):
+        state = None
+
+    headers = {}
+    if state:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+
+    # Загрузка HTML
+    response = get_client(config).get(site_url, headers=headers)
+    update_time = datetime.now().strftime("%d.%m.%Y %H:%M")
+
+    if state and response.status_code == 304:
+        logger.info("Страница расписания не изменилась (304 Not Modified)")
+        return update_time, NOT_MODIFIED, None
+
+    response.raise_for_status()
+    raw_hash = hashlib.md5(response.content).hexdigest()
+    new_state = {
+        'site_url': site_url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'raw_hash': raw_hash
+    }
+
+    if state and state.get('raw_hash') == raw_hash:
+        # Содержимое то же - парсинг не нужен, обновляем только валидаторы
+        new_state['schedule_hash'] = known_hash
+        if new_state != state:
+            save_fetch_state(new_state, state_file)
+        logger.info("Страница расписания не изменилась (совпадает хеш ответа)")
+        return update_time, NOT_MODIFIED, None
+
+    response.encoding = 'windows-1251'
+    fetch_state = {
+        'state_file': state_file,
+        'state': new_state,
+        'engine': config.get("parser_engine", DEFAULT_PARSER_ENGINE)
+    }
+    return update_time, response.text, fetch_state
+
+def parse_schedule_page(html_content, engine=DEFAULT_PARSER_ENGINE):
+    """
+    Парсит страницу расписания и выбрасывает исключение, если таблица не найдена.
+    Не зависит от состояния модуля, поэтому может выполняться в отдельном процессе.
+    """
+    schedule_data = parse_schedule(html_content, engine)
+    if "error" in schedule_data:
+        raise Exception(schedule_data["error"])
+    return schedule_data
+
+def commit_fetch_state(fetch_state, schedule_data):
+    """Сохраняет состояние загрузки вместе с хешем разобранного расписания."""
+    new_state = dict(fetch_state['state'], schedule_hash=get_schedule_hash(schedule_data))
+    try:
+        save_fetch_state(new_state, fetch_state['state_file'])
+    except OSError as e:
+        logger.error(f"Ошибка сохранения состояния загрузки: {e}")
+
+def get_schedule(known_hash=None, source=None):
     """
     Основная функция для получения расписания с сайта.
     Возвращает кортеж (update_time, schedule_data).
+    source - источник {'name', 'url'} из sources.get_sources; по умолчанию первый.
+
+    Если передан known_hash (хеш расписания, которое уже есть у вызывающего),
+    запрос отправляется с If-None-Match/If-Modified-Since, и при ответе 304
+    или совпадении хеша сырого ответа вместо данных возвращается NOT_MODIFIED.
     """
     try:
-        # Загрузка конфигурации
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        
-        site_url = config.get("site_url")
-        if not site_url:
-            raise Exception("В config.json не найден ключ 'site_url'")
-
-        # Загрузка HTML
-        response = requests.get(site_url, timeout=10)
-        response.raise_for_status()
-        response.encoding = 'windows-1251'
-        html_content = response.text
+        update_time, html_content, fetch_state = fetch_schedule_page(known_hash, source)
+        if html_content is NOT_MODIFIED:
+            return update_time, NOT_MODIFIED
 
         # Парсинг
-        schedule_data = parse_schedule(html_content)
-        if "error" in schedule_data:
-            raise Exception(schedule_data["error"])
+        schedule_data = parse_schedule_page(html_content, fetch_state['engine'])
+        commit_fetch_state(fetch_state, schedule_data)
 
-        return datetime.now().strftime("%d.%m.%Y %H:%M"), schedule_data
+        return update_time, schedule_data
 
     except Exception as e:
         logger.error(f"Ошибка в get_schedule: {e}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для ключа rate_limits в config.json:
+# {"команда": {"requests": запросов, "period": за сколько секунд}}
+DEFAULT_LIMIT = 'default'
+DEFAULT_RATE_LIMITS = {
+    DEFAULT_LIMIT: {'requests': 15, 'period': 10},
+    'check': {'requests': 5, 'period': 30},
+}
+# Сколько корзин хранится в памяти; при превышении вытесняются давно не писавшие пользователи
+DEFAULT_MAX_BUCKETS = 10000
+
+class Bucket:
+    """Состояние одного пользователя для одной команды"""
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов по алгоритму token bucket.
+    Проверка выполняется за O(1); корзины хранятся в порядке последнего
+    обращения и вытесняются, когда полностью восстановились или когда их больше max_buckets.
+    Используется только из цикла событий бота, поэтому без блокировок.
+    """
+
+    def __init__(self, limits=None, max_buckets=DEFAULT_MAX_BUCKETS, clock=time.monotonic):
+        self.clock = clock
+        self.max_buckets = max(1, max_buckets)
+        self.buckets = OrderedDict()  # {(user_id, команда): Bucket}
+        self.limits = {}  # {команда: (емкость, токенов в секунду)}
+        self.configure(limits)
+
+    def configure(self, limits=None):
+        """Задает лимиты; команды без своего лимита используют лимит default"""
+        merged = {name: dict(limit) for name, limit in DEFAULT_RATE_LIMITS.items()}
+        for name, limit in (limits or {}).items():
+            try:
+                requests = int(limit.get('requests', 0))
+                period = float(limit.get('period', 0))
+            except (AttributeError, TypeError, ValueError):
+                requests = period = 0
+            if requests < 1 or period <= 0:
+                logger.error(f"Некорректный лимит запросов для {name}: {limit}")
+                continue
+            merged[name] = {'requests': requests, 'period': period}
+
+        self.limits = {
+            name: (limit['requests'], limit['requests'] / limit['period'])
+            for name, limit in merged.items()
+        }
+        # Старые корзины могли быть рассчитаны на другую емкость
+        self.buckets.clear()
+
+    def _limit(self, command):
+        return self.limits.get(command) or self.limits[DEFAULT_LIMIT]
+
+    def acquire(self, user_id, command=DEFAULT_LIMIT):
+        """
+        Списывает один токен. Возвращает 0, если запрос разрешен,
+        иначе - через сколько секунд появится следующий токен.
+        """
+        capacity, rate = self._limit(command)
+        now = self.clock()
+        key = (user_id, command)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            # Новая корзина сразу неполная, поэтому вытеснение ее не затронет
+            self.buckets[key] = Bucket(capacity - 1, now)
+            self._evict(now)
+            return 0
+
+        bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        self.buckets.move_to_end(key)
+        if bucket.tokens < 1:
+            return (1 - bucket.tokens) / rate
+        bucket.tokens -= 1
+        return 0
+
+    def _evict(self, now):
+        """Удаляет самые старые корзины: восстановившиеся полностью и сверх max_buckets"""
+        while self.buckets:
+            (user_id, command), bucket = next(iter(self.buckets.items()))
+            capacity, rate = self._limit(command)
+            idle = bucket.tokens + (now - bucket.updated) * rate >= capacity
+            if not idle and len(self.buckets) <= self.max_buckets:
+                break
+            self.buckets.popitem(last=False)
+
+    def clear(self):
+        self.buckets.clear()
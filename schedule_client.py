@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для ключей config.json
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30
+POOL_SIZE = 4
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class ScheduleClient:
+    """
+    HTTP-клиент для загрузки страниц расписания.
+    Держит постоянный пул keep-alive соединений, повторяет запросы
+    с экспоненциальной задержкой и джиттером и замеряет каждую попытку.
+    """
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, pool_size=POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.last_attempts = []
+
+        self.session = requests.Session()
+        # Повторы делаем сами, чтобы видеть время каждой попытки
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _delay(self, attempt, response=None):
+        """Задержка перед повтором: Retry-After или экспонента с полным джиттером"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(int(retry_after), MAX_BACKOFF)
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def get(self, url, headers=None):
+        """
+        Выполняет GET с повторами. Возвращает requests.Response,
+        у которого в атрибуте fetch_attempts лежат замеры всех попыток.
+        """
+        attempts = []
+        total_attempts = self.retries + 1
+
+        for attempt in range(total_attempts):
+            started = time.perf_counter()
+            record = {'attempt': attempt + 1, 'status': None, 'headers_time': None,
+                      'total_time': None, 'error': None}
+            attempts.append(record)
+            response = None
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                # Тело читается внутри get, elapsed - время до получения заголовков
+                record['status'] = response.status_code
+                record['headers_time'] = round(response.elapsed.total_seconds(), 4)
+                record['total_time'] = round(time.perf_counter() - started, 4)
+
+                if response.status_code not in RETRY_STATUSES or attempt == total_attempts - 1:
+                    break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                record['total_time'] = round(time.perf_counter() - started, 4)
+                record['error'] = type(e).__name__
+                if attempt == total_attempts - 1:
+                    self._log_attempts(url, attempts)
+                    raise
+
+            delay = self._delay(attempt, response)
+            record['retry_delay'] = round(delay, 3)
+            time.sleep(delay)
+
+        self._log_attempts(url, attempts)
+        response.fetch_attempts = attempts
+        return response
+
+    def _log_attempts(self, url, attempts):
+        """Сохраняет и логирует замеры попыток"""
+        self.last_attempts = attempts
+        summary = '; '.join(
+            f"#{a['attempt']}: {a['error'] or a['status']} "
+            f"(заголовки {a['headers_time'] if a['headers_time'] is not None else '-'} с, "
+            f"всего {a['total_time']} с)"
+            for a in attempts
+        )
+        level = logging.WARNING if len(attempts) > 1 or attempts[-1]['error'] else logging.INFO
+        logger.log(level, f"Загрузка {url}: {summary}")
+
+_client = None
+_client_settings = None
+_client_lock = threading.Lock()
+
+def get_client(config=None):
+    """Возвращает общий клиент, пересоздавая его при изменении настроек в config.json"""
+    global _client, _client_settings
+    config = config or {}
+    settings = (
+        config.get('fetch_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+        config.get('fetch_read_timeout', DEFAULT_READ_TIMEOUT),
+        config.get('fetch_retries', DEFAULT_RETRIES),
+        config.get('fetch_backoff', DEFAULT_BACKOFF),
+    )
+    with _client_lock:
+        if _client is None or _client_settings != settings:
+            if _client is not None:
+                _client.session.close()
+            _client = ScheduleClient(*settings)
+            _client_settings = settings
+        return _client
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import json
+import hashlib
+from datetime import datetime
+
+# Лимит длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+DATE_FORMATS = ("%d.%m.%Y", "%d.%m.%y")
+
+def message_length(text):
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def day_hash(day_data):
+    """Хеш одного дня расписания"""
+    return hashlib.md5(json.dumps(day_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def day_hashes(schedule):
+    """Хеши всех дней расписания {дата: хеш}"""
+    return {date: day_hash(day_data) for date, day_data in (schedule or {}).items()}
+
+def _group_by_number(lessons):
+    """Группирует занятия дня по номеру пары с сохранением порядка"""
+    grouped = {}
+    for lesson in lessons:
+        grouped.setdefault(lesson.get('lesson_number'), []).append(lesson)
+    return grouped
+
+def diff_day(old_day, new_day):
+    """Сравнивает два дня по номерам пар: добавленные, удаленные и измененные занятия"""
+    old_lessons = _group_by_number(old_day.get('lessons', []))
+    new_lessons = _group_by_number(new_day.get('lessons', []))
+
+    added = []
+    removed = []
+    modified = []
+    for number, lessons in new_lessons.items():
+        if number not in old_lessons:
+            added.extend(lessons)
+        elif old_lessons[number] != lessons:
+            modified.append({'lesson_number': number, 'old': old_lessons[number], 'new': lessons})
+    for number, lessons in old_lessons.items():
+        if number not in new_lessons:
+            removed.extend(lessons)
+
+    result = {'added': added, 'removed': removed, 'modified': modified}
+    if old_day.get('day_of_week') != new_day.get('day_of_week'):
+        result['day_of_week'] = new_day.get('day_of_week')
+    return result
+
+def diff_schedules(old_schedule, new_schedule, old_hashes=None, new_hashes=None):
+    """
+    Сравнивает два результата parse_schedule по датам и номерам пар.
+    Дни с одинаковым хешем пропускаются без разбора занятий.
+    Возвращает {'added_days': {...}, 'removed_days': {...}, 'changed_days': {...}}.
+    """
+    old_schedule = old_schedule or {}
+    new_schedule = new_schedule or {}
+    old_hashes = old_hashes if old_hashes is not None else day_hashes(old_schedule)
+    new_hashes = new_hashes if new_hashes is not None else day_hashes(new_schedule)
+
+    diff = {'added_days': {}, 'removed_days': {}, 'changed_days': {}}
+    for date, new_day in new_schedule.items():
+        if date not in old_schedule:
+            diff['added_days'][date] = new_day
+        elif old_hashes.get(date) != new_hashes.get(date):
+            diff['changed_days'][date] = diff_day(old_schedule[date], new_day)
+    for date, old_day in old_schedule.items():
+        if date not in new_schedule:
+            diff['removed_days'][date] = old_day
+    return diff
+
+def _parse_date(date):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(date, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+def significant_changes(diff, today=None):
+    """
+    Убирает из разницы изменения, о которых не нужно уведомлять:
+    удаление уже прошедших дней при сдвиге недели.
+    """
+    today = today or datetime.now().date()
+    removed_days = {}
+    for date, day_data in diff['removed_days'].items():
+        parsed = _parse_date(date)
+        if parsed is None or parsed >= today:
+            removed_days[date] = day_data
+    return {
+        'added_days': diff['added_days'],
+        'removed_days': removed_days,
+        'changed_days': diff['changed_days']
+    }
+
+def has_changes(diff):
+    """Есть ли в разнице хоть одно изменение"""
+    return any(diff[key] for key in ('added_days', 'removed_days', 'changed_days'))
+
+def changed_dates(diff):
+    """Даты, затронутые изменениями"""
+    return sorted(
+        set(diff['added_days']) | set(diff['removed_days']) | set(diff['changed_days']),
+        key=lambda date: (_parse_date(date) or datetime.max.date(), date)
+    )
+
+def format_lesson(lesson):
+    """Строка с описанием занятия в стиле сообщений бота"""
+    if lesson.get("name") == "Свободно":
+        return f"{lesson.get('lesson_number', '?')}: Нет пары"
+    subgroup = f" ({lesson['subgroup']})" if lesson.get("subgroup") else ""
+    return (
+        f"{lesson.get('lesson_number', '?')}: "
+        f"{lesson.get('name', 'Неизвестно')} - "
+        f"{lesson.get('auditorium', '')} "
+        f"(👨‍🏫 {lesson.get('teacher', '')}){subgroup}"
+    )
+
+def format_diff(diff, header="", footer="", max_length=MAX_MESSAGE_LENGTH):
+    """
+    Формирует текст уведомления с изменившимися днями.
+    Если текст не помещается в max_length, оставшиеся дни заменяются примечанием.
+    """
+    blocks = []
+    for date in changed_dates(diff):
+        if date in diff['added_days']:
+            day = diff['added_days'][date]
+            lines = [f"📅 {date} ({day.get('day_of_week', '')}) - новый день:"]
+            lines += [f"➕ {format_lesson(lesson)}" for lesson in day.get('lessons', [])]
+        elif date in diff['removed_days']:
+            day = diff['removed_days'][date]
+            lines = [f"📅 {date} ({day.get('day_of_week', '')}) - день удален"]
+        else:
+            day = diff['changed_days'][date]
+            lines = [f"📅 {date}:"]
+            if 'day_of_week' in day:
+                lines.append(f"✏️ День недели: {day['day_of_week']}")
+            lines += [f"➕ {format_lesson(lesson)}" for lesson in day['added']]
+            lines += [f"➖ {format_lesson(lesson)}" for lesson in day['removed']]
+            for change in day['modified']:
+                lines += [f"✏️ было {format_lesson(lesson)}" for lesson in change['old']]
+                lines += [f"✏️ стало {format_lesson(lesson)}" for lesson in change['new']]
+        blocks.append("\n".join(lines))
+
+    text = header
+    for index, block in enumerate(blocks):
+        rest = len(blocks) - index
+        note = f"\n… и еще {rest} дн. - /check"
+        if message_length(text + block + note + footer) + 2 > max_length:
+            text += note
+            break
+        text += block + "\n\n"
+    return (text + footer).strip()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import gzip
+import hashlib
+import logging
+from datetime import datetime
+
+from schedule_diff import day_hash, diff_schedules
+
+logger = logging.getLogger(__name__)
+
+BLOCKS_DIR = 'blocks'
+VERSIONS_DIR = 'versions'
+DIFFS_DIR = 'diffs'
+VERSION_SUFFIX = '_schedule.json.gz'
+MANIFEST_NAME = 'manifest.jsonl'
+MANIFEST_READ_CHUNK = 8192
+LAST_SCHEDULE_NAME = 'last_schedule.json'
+DEFAULT_KEEP_VERSIONS = 500
+# Чистка запускается, когда версий на PRUNE_SLACK больше лимита
+PRUNE_SLACK = 50
+
+TIMESTAMP_RE = re.compile(r'(\d{8}_\d{6})')
+# Версии одной секунды: <время>_schedule.json.gz, <время>_1_schedule.json.gz, ...
+VERSION_NAME_RE = re.compile(r'(\d{8}_\d{6})(?:_(\d+))?' + re.escape(VERSION_SUFFIX) + '$')
+
+def version_sort_key(name):
+    """
+    Ключ хронологического порядка версий: (время, номер в пределах секунды, имя).
+    По строке <время>_1_schedule.json.gz оказалась бы раньше <время>_schedule.json.gz.
+    """
+    match = VERSION_NAME_RE.search(name)
+    if match:
+        return match.group(1), int(match.group(2) or 0), name
+    match = TIMESTAMP_RE.search(name)
+    return (match.group(1) if match else ''), 0, name
+
+def _write_atomic(path, data):
+    """Записывает байты во временный файл и атомарно переименовывает его"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _pack(obj):
+    return gzip.compress(json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def _unpack(path):
+    with gzip.open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+class ScheduleStore:
+    """
+    История расписаний одного источника с дедупликацией по дням.
+    Каждый уникальный день хранится один раз в blocks/<хеш>.json.gz,
+    а версия - это небольшой сжатый файл versions/<время>_schedule.json.gz
+    со списком пар (дата, хеш дня).
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.blocks_dir = os.path.join(base_dir, BLOCKS_DIR)
+        self.versions_dir = os.path.join(base_dir, VERSIONS_DIR)
+        self.diffs_dir = os.path.join(base_dir, DIFFS_DIR)
+        self.manifest_file = os.path.join(base_dir, MANIFEST_NAME)
+
+    def _ensure_dirs(self):
+        os.makedirs(self.blocks_dir, exist_ok=True)
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def _block_path(self, block_hash):
+        return os.path.join(self.blocks_dir, f"{block_hash}.json.gz")
+
+    def _diff_path(self, hash_a, hash_b):
+        return os.path.join(self.diffs_dir, f"{hash_a}_{hash_b}.json.gz")
+
+    def list_versions(self):
+        """Имена версий от старых к новым"""
+        try:
+            names = os.listdir(self.versions_dir)
+        except FileNotFoundError:
+            return []
+        return sorted((name for name in names if name.endswith(VERSION_SUFFIX)), key=version_sort_key)
+
+    def legacy_files(self):
+        """Файлы истории старого формата (по одному JSON на версию)"""
+        try:
+            names = os.listdir(self.base_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            name for name in names
+            if name.endswith('.json') and name != LAST_SCHEDULE_NAME and TIMESTAMP_RE.search(name)
+        )
+
+    def save_version(self, update_time, schedule, schedule_hash, timestamp=None):
+        """
+        Сохраняет версию расписания, дописывая только новые дни.
+        Возвращает имя версии; если последняя версия с тем же хешем, новая не создается.
+        """
+        self._ensure_dirs()
+        versions = self.list_versions()
+        previous = None
+        if versions:
+            try:
+                previous = self.load_record(versions[-1])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать версию {versions[-1]}: {e}")
+            if previous is not None and previous.get('hash') == schedule_hash:
+                return versions[-1]
+
+        name, record = self._write_version(update_time, schedule, schedule_hash, timestamp)
+
+        # Разница с предыдущей версией понадобится при просмотре истории - считаем сразу
+        if previous is not None:
+            self._precompute_diff(previous, record, name)
+
+        self._append_manifest(self._manifest_entry(name, update_time, schedule, schedule_hash))
+        return name
+
+    def _write_version(self, update_time, schedule, schedule_hash, timestamp=None):
+        """Записывает новые дни и файл версии; возвращает (имя версии, запись)"""
+        days = []
+        for date, day_data in schedule.items():
+            block_hash = day_hash(day_data)
+            block_path = self._block_path(block_hash)
+            if not os.path.exists(block_path):
+                _write_atomic(block_path, _pack(day_data))
+            days.append([date, block_hash])
+
+        timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+        name = f"{timestamp}{VERSION_SUFFIX}"
+        counter = 1
+        while os.path.exists(os.path.join(self.versions_dir, name)):
+            name = f"{timestamp}_{counter}{VERSION_SUFFIX}"
+            counter += 1
+
+        record = {
+            'update_time': update_time,
+            'hash': schedule_hash,
+            'days': days
+        }
+        _write_atomic(os.path.join(self.versions_dir, name), _pack(record))
+        return name, record
+
+    def _precompute_diff(self, record_a, record_b, name):
+        try:
+            self.diff_records(record_a, record_b)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ошибка подсчета разницы для версии {name}: {e}")
+
+    @staticmethod
+    def _manifest_entry(name, update_time, schedule, schedule_hash):
+        """Строка манифеста: все, что нужно для списка версий без чтения самих версий"""
+        return {
+            'filename': name,
+            'update_time': update_time,
+            'hash': schedule_hash,
+            'size': len(json.dumps(schedule, ensure_ascii=False).encode('utf-8')),
+            'lessons': sum(len(day.get('lessons', [])) for day in schedule.values())
+        }
+
+    def _append_manifest(self, entry):
+        """Дописывает версию в конец манифеста"""
+        if not os.path.exists(self.manifest_file) and len(self.list_versions()) > 1:
+            # Версии, созданные до появления манифеста, добавляются при его создании
+            self.rebuild_manifest()
+            return
+        with open(self.manifest_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def rebuild_manifest(self):
+        """Пересобирает манифест по файлам версий"""
+        lines = []
+        for name in self.list_versions():
+            try:
+                data = self.load_version(name)
+            except (OSError, ValueError) as e:
+                logger.error(f"Ошибка чтения версии {name} при сборке манифеста: {e}")
+                continue
+            entry = self._manifest_entry(name, data['update_time'], data['schedule'], data['hash'])
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.makedirs(self.base_dir, exist_ok=True)
+        _write_atomic(self.manifest_file, ''.join(lines).encode('utf-8'))
+
+    def read_manifest(self, offset=0, limit=50):
+        """
+        Возвращает (версии, есть_еще) от новых к старым.
+        Файл читается с конца блоками, пока не наберется offset + limit строк.
+        """
+        if not os.path.exists(self.manifest_file):
+            if not self.list_versions():
+                return [], False
+            self.rebuild_manifest()
+
+        needed = offset + limit + 1
+        lines = []
+        with open(self.manifest_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            tail = b''
+            while position > 0 and len(lines) < needed:
+                step = min(MANIFEST_READ_CHUNK, position)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step) + tail
+                parts = chunk.split(b'\n')
+                # Первая часть может быть обрезанной строкой - оставляем до следующего блока
+                tail = parts[0] if position > 0 else b''
+                complete = parts[1:] if position > 0 else parts
+                lines = [line for line in complete if line.strip()] + lines
+            if tail.strip():
+                lines = [tail] + lines
+
+        newest_first = lines[::-1]
+        entries = []
+        for line in newest_first[offset:offset + limit]:
+            try:
+                entries.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                continue
+        return entries, len(newest_first) > offset + limit
+
+    def diff_records(self, record_a, record_b):
+        """
+        Разница между двумя версиями (результат diff_schedules).
+        Читаются только дни, хеши которых отличаются; результат сохраняется в diffs/.
+        """
+        hash_a = record_a.get('hash')
+        hash_b = record_b.get('hash')
+        diff_path = self._diff_path(hash_a, hash_b) if hash_a and hash_b else None
+        if diff_path and os.path.exists(diff_path):
+            return _unpack(diff_path)
+
+        hashes_a = dict(record_a['days'])
+        hashes_b = dict(record_b['days'])
+        schedule_a = {}
+        schedule_b = {}
+        for date, block_hash in record_a['days']:
+            if hashes_b.get(date) != block_hash:
+                schedule_a[date] = _unpack(self._block_path(block_hash))
+        for date, block_hash in record_b['days']:
+            if hashes_a.get(date) != block_hash:
+                schedule_b[date] = _unpack(self._block_path(block_hash))
+        diff = diff_schedules(schedule_a, schedule_b, hashes_a, hashes_b)
+
+        if diff_path:
+            os.makedirs(self.diffs_dir, exist_ok=True)
+            _write_atomic(diff_path, _pack(diff))
+        return diff
+
+    def load_record(self, name):
+        """Запись версии без содержимого дней"""
+        return _unpack(os.path.join(self.versions_dir, os.path.basename(name)))
+
+    def load_version(self, name):
+        """
+        Загружает версию в формате {'update_time', 'schedule', 'hash'}.
+        Понимает и имена старых JSON-файлов, которые еще не перенесены в хранилище.
+        """
+        name = os.path.basename(name)
+        if name.endswith('.json') and not name.endswith('.gz'):
+            with open(os.path.join(self.base_dir, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if 'schedule' not in data:
+                # parser.py в standalone-режиме сохранял расписание без метаданных
+                data = {'update_time': '', 'schedule': data, 'hash': None}
+            return data
+
+        record = self.load_record(name)
+        schedule = {}
+        for date, block_hash in record['days']:
+            schedule[date] = _unpack(self._block_path(block_hash))
+        return {
+            'update_time': record.get('update_time', ''),
+            'schedule': schedule,
+            'hash': record.get('hash')
+        }
+
+    def prune(self, keep=DEFAULT_KEEP_VERSIONS, slack=PRUNE_SLACK):
+        """Удаляет старые версии сверх лимита и дни, на которые больше никто не ссылается"""
+        versions = self.list_versions()
+        if len(versions) <= keep + slack:
+            return 0
+
+        for name in versions[:-keep]:
+            try:
+                os.remove(os.path.join(self.versions_dir, name))
+            except OSError as e:
+                logger.error(f"Ошибка удаления старой версии расписания {name}: {e}")
+
+        referenced = set()
+        schedule_hashes = set()
+        for name in self.list_versions():
+            try:
+                record = self.load_record(name)
+                referenced.update(block_hash for _, block_hash in record['days'])
+                schedule_hashes.add(record.get('hash'))
+            except (OSError, ValueError) as e:
+                # Без полного списка ссылок блоки удалять нельзя
+                logger.error(f"Ошибка чтения версии {name}, очистка дней пропущена: {e}")
+                return len(versions) - keep
+
+        for filename in os.listdir(self.blocks_dir):
+            if filename.endswith('.json.gz') and filename[:-len('.json.gz')] not in referenced:
+                try:
+                    os.remove(os.path.join(self.blocks_dir, filename))
+                except OSError as e:
+                    logger.error(f"Ошибка удаления блока {filename}: {e}")
+
+        if os.path.isdir(self.diffs_dir):
+            for filename in os.listdir(self.diffs_dir):
+                pair = filename[:-len('.json.gz')].split('_')
+                if not all(schedule_hash in schedule_hashes for schedule_hash in pair):
+                    try:
+                        os.remove(os.path.join(self.diffs_dir, filename))
+                    except OSError as e:
+                        logger.error(f"Ошибка удаления разницы {filename}: {e}")
+
+        self._drop_from_manifest(set(versions[:-keep]))
+        return len(versions) - keep
+
+    def _drop_from_manifest(self, names):
+        """Убирает удаленные версии из манифеста"""
+        if not os.path.exists(self.manifest_file):
+            return
+        kept = []
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    if json.loads(line)['filename'] in names:
+                        continue
+                except (ValueError, KeyError):
+                    continue
+                kept.append(line)
+        _write_atomic(self.manifest_file, ''.join(kept).encode('utf-8'))
+
+    def compact(self):
+        """
+        Переносит файлы истории старого формата в хранилище и удаляет их.
+        Файлы и уже записанные версии обходятся вместе по времени: файл, совпадающий
+        с версией непосредственно перед ним, не сохраняется, а разница считается
+        с соседними по времени версиями. Возвращает (перенесено, пропущено).
+        """
+        self._ensure_dirs()
+        timeline = []  # (время, имя, запись версии или None для файла старого формата)
+        for name in self.list_versions():
+            try:
+                timeline.append((TIMESTAMP_RE.search(name).group(1), name, self.load_record(name)))
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(f"Не удалось прочитать версию {name}: {e}")
+        for filename in self.legacy_files():
+            timeline.append((TIMESTAMP_RE.search(filename).group(1), filename, None))
+        timeline.sort(key=lambda item: version_sort_key(item[1]))
+
+        moved = 0
+        skipped = 0
+        previous = None
+        previous_moved = False
+        for timestamp, name, record in timeline:
+            if record is not None:
+                # Перед этой версией встала перенесенная - прежняя разница к ней больше не соседняя
+                if previous_moved and previous.get('hash') != record.get('hash'):
+                    self._precompute_diff(previous, record, name)
+                previous = record
+                previous_moved = False
+                continue
+
+            path = os.path.join(self.base_dir, name)
+            try:
+                data = self.load_version(name)
+                schedule = data['schedule']
+                schedule_hash = data.get('hash') or hashlib.md5(
+                    json.dumps(schedule, sort_keys=True).encode('utf-8')).hexdigest()
+                update_time = data.get('update_time') or datetime.strptime(
+                    timestamp, "%Y%m%d_%H%M%S").strftime("%d.%m.%Y %H:%M")
+                if previous is None or previous.get('hash') != schedule_hash:
+                    version_name, new_record = self._write_version(
+                        update_time, schedule, schedule_hash, timestamp=timestamp)
+                    if previous is not None:
+                        self._precompute_diff(previous, new_record, version_name)
+                    previous = new_record
+                    previous_moved = True
+                os.remove(path)
+                moved += 1
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                logger.error(f"Не удалось перенести {path}: {e}")
+                skipped += 1
+        if moved:
+            # Перенесенные версии старше уже записанных - восстанавливаем порядок манифеста
+            self.rebuild_manifest()
+        return moved, skipped
+
+def compact_all(schedules_dir='schedules'):
+    """Переносит историю всех источников (schedules/ и его подпапок) в хранилище"""
+    dirs = [schedules_dir] + [
+        os.path.join(schedules_dir, name) for name in sorted(os.listdir(schedules_dir))
+        if os.path.isdir(os.path.join(schedules_dir, name)) and name not in (BLOCKS_DIR, VERSIONS_DIR, DIFFS_DIR)
+    ]
+    for base_dir in dirs:
+        store = ScheduleStore(base_dir)
+        if not store.legacy_files():
+            continue
+        moved, skipped = store.compact()
+        print(f"{base_dir}: перенесено версий {moved}, с ошибками {skipped}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != 'compact':
+        print("Использование: python schedule_store.py compact")
+        sys.exit(1)
+    compact_all()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import asyncio
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом: выполняется только первый,
+    остальные ждут его результат или исключение. Завершенные вызовы не кешируются.
+    Используется только из цикла событий бота.
+    """
+
+    def __init__(self):
+        self.inflight = {}  # {ключ: asyncio.Future}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key, func, *args, **kwargs):
+        """Возвращает await func(*args, **kwargs), разделяя уже идущий вызов с тем же ключом"""
+        self.calls += 1
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: отмена одного ожидающего не отменяет общий вызов
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.executed += 1
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Без ожидающих исключение иначе попадет в лог как неполученное
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        return {'calls': self.calls, 'executed': self.executed, 'coalesced': self.coalesced}
+
+    def summary(self):
+        saved = self.coalesced / self.calls * 100 if self.calls else 0.0
+        return f"вызовов {self.calls}, выполнено {self.executed}, объединено {self.coalesced} ({saved:.0f}%)"
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import os
+import re
+import hashlib
+
+from schedule_store import BLOCKS_DIR, VERSIONS_DIR, DIFFS_DIR
+
+SCHEDULES_DIR = 'schedules'
+
+# Источник, собранный из старого ключа site_url; его история лежит прямо в schedules/
+DEFAULT_SOURCE = 'default'
+DEFAULT_MAX_CONCURRENT_FETCHES = 4
+# Подпапки хранилища schedules/ - папка источника не может называться так же
+RESERVED_DIRS = {BLOCKS_DIR, VERSIONS_DIR, DIFFS_DIR}
+SAFE_NAME_RE = re.compile(r'[\w\-]+')
+
+def get_sources(config):
+    """
+    Возвращает список источников расписания [{'name': ..., 'url': ...}].
+    Если в конфиге нет списка sources, используется site_url как единственный источник.
+    """
+    config = config or {}
+    sources = []
+    seen = set()
+    for source in config.get('sources') or []:
+        name = str(source.get('name', '')).strip()
+        url = str(source.get('url', '')).strip()
+        if name and url and name not in seen:
+            sources.append({'name': name, 'url': url})
+            seen.add(name)
+
+    if not sources and config.get('site_url'):
+        sources.append({'name': DEFAULT_SOURCE, 'url': config['site_url']})
+    return sources
+
+def find_source(config, name=None):
+    """Находит источник по имени; без имени возвращает первый"""
+    sources = get_sources(config)
+    if name is None:
+        return sources[0] if sources else None
+    for source in sources:
+        if source['name'] == name:
+            return source
+    return None
+
+def source_dir(name):
+    """Папка с историей расписаний источника"""
+    if name == DEFAULT_SOURCE:
+        return SCHEDULES_DIR
+    if SAFE_NAME_RE.fullmatch(name) and name not in RESERVED_DIRS:
+        return os.path.join(SCHEDULES_DIR, name)
+    # Остальные имена приводятся к безопасным, а чтобы разные источники не попали
+    # в одну папку, добавляется хеш имени; точки в безопасных именах нет, поэтому
+    # такая папка не совпадет ни с одним именем из первой ветки
+    safe_name = re.sub(r'[^\w\-]+', '_', name).strip('_') or 'source'
+    name_hash = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(SCHEDULES_DIR, f"{safe_name}.{name_hash}")
+
+def user_groups(user_data, sources):
+    """
+    Группы, на которые подписан пользователь.
+    Пользователи без поля groups подписаны на первый источник.
+    """
+    names = [source['name'] for source in sources]
+    groups = (user_data or {}).get('groups')
+    if groups is None:
+        return names[:1]
+    return [group for group in groups if group in names]
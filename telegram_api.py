@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для ключей config.json
+DEFAULT_API_URL = 'https://api.telegram.org'
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 16
+
+class TelegramClient:
+    """
+    Клиент Bot API для админ-панели с общим пулом соединений.
+    Соединения (и TLS-сессии) переиспользуются между запросами и потоками рассылки.
+    HTTP/2 включается ключом telegram_http2 и работает только при установленном httpx[http2];
+    иначе используется requests с keep-alive.
+    """
+
+    def __init__(self, token, api_url=DEFAULT_API_URL, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, pool_size=DEFAULT_POOL_SIZE, http2=False):
+        self.base_url = f"{api_url.rstrip('/')}/bot{token}/"
+        self.timeout = (connect_timeout, read_timeout)
+        self.http2 = False
+        self.session = None
+        self.client = None
+
+        if http2:
+            try:
+                import h2  # noqa: F401 - без него httpx не включит HTTP/2
+                import httpx
+                self.client = httpx.Client(
+                    http2=True,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                )
+                self.http2 = True
+            except ImportError as e:
+                logger.warning(f"HTTP/2 недоступен ({e}), используется HTTP/1.1 с keep-alive")
+
+        if self.client is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+    def call(self, method, **params):
+        """
+        Вызывает метод Bot API и возвращает его ответ {'ok': ..., 'result' | 'description', ...}.
+        Сетевые ошибки пробрасываются.
+        """
+        url = self.base_url + method
+        if self.client is not None:
+            response = self.client.post(url, json=params)
+        else:
+            response = self.session.post(url, json=params, timeout=self.timeout)
+        try:
+            return response.json()
+        except ValueError:
+            return {'ok': False, 'error_code': response.status_code,
+                    'description': f"HTTP {response.status_code}"}
+
+    def send_message(self, chat_id, text, **params):
+        return self.call('sendMessage', chat_id=chat_id, text=text, **params)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        if self.session is not None:
+            self.session.close()
+
+_clients = {}  # {(токен, настройки): TelegramClient}
+_clients_lock = threading.Lock()
+
+def get_telegram_client(token, config=None):
+    """
+    Общий клиент процесса для token и настроек из config.json
+    (telegram_api_url, telegram_connect_timeout, telegram_read_timeout, telegram_pool_size, telegram_http2).
+    При смене токена или настроек создается новый клиент; старый не закрывается явно,
+    чтобы не оборвать запросы идущей рассылки, и освобождается сборщиком мусора.
+    """
+    config = config or {}
+    settings = (
+        config.get('telegram_api_url', DEFAULT_API_URL),
+        config.get('telegram_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+        config.get('telegram_read_timeout', DEFAULT_READ_TIMEOUT),
+        max(1, int(config.get('telegram_pool_size', DEFAULT_POOL_SIZE))),
+        bool(config.get('telegram_http2', False)),
+    )
+    key = (token, settings)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            _clients.clear()
+            client = _clients[key] = TelegramClient(token, *settings)
+        return client
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+USERS_DIR = 'users'
+DB_FILE = os.path.join(USERS_DIR, 'users.db')
+# Сюда переносятся файлы users/<id>.json после миграции в базу
+MIGRATED_DIR = os.path.join(USERS_DIR, 'migrated_json')
+MIGRATION_BATCH = 500
+ITER_BATCH = 500
+BUSY_TIMEOUT_MS = 5000
+# Значение по умолчанию для ключа user_flags_refresh в config.json (секунды)
+DEFAULT_FLAGS_REFRESH = 2
+# Сколько последних изменений флагов хранится в user_changes
+MAX_FLAG_CHANGES = 10000
+
+# Подписки пользователя {user}: строка на каждую группу из data.groups
+# или одна строка с grp = '', если поля groups нет
+_SUBSCRIPTIONS_SELECT = """
+    SELECT {user}.user_id, COALESCE(g.value, ''), {user}.chat_id
+    FROM (SELECT 1) LEFT JOIN json_each({user}.data, '$.groups') AS g
+    WHERE {user}.notifications = 1 AND {user}.banned = 0 AND {user}.chat_id IS NOT NULL
+      AND (COALESCE(json_type({user}.data, '$.groups'), 'null') = 'null' OR g.value IS NOT NULL)"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    banned INTEGER NOT NULL DEFAULT 0,
+    notifications INTEGER NOT NULL DEFAULT 0,
+    chat_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_banned ON users(banned);
+CREATE INDEX IF NOT EXISTS idx_users_notifications ON users(notifications);
+CREATE INDEX IF NOT EXISTS idx_users_chat_id ON users(chat_id);
+
+-- Журнал изменений флагов: по нему другие процессы обновляют свой кеш
+CREATE TABLE IF NOT EXISTS user_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    banned INTEGER NOT NULL,
+    notifications INTEGER NOT NULL,
+    chat_id INTEGER
+);
+CREATE TRIGGER IF NOT EXISTS users_flags_insert AFTER INSERT ON users BEGIN
+    INSERT INTO user_changes (user_id, banned, notifications, chat_id)
+    VALUES (NEW.user_id, NEW.banned, NEW.notifications, NEW.chat_id);
+END;
+CREATE TRIGGER IF NOT EXISTS users_flags_update AFTER UPDATE ON users
+WHEN OLD.banned IS NOT NEW.banned OR OLD.notifications IS NOT NEW.notifications
+    OR OLD.chat_id IS NOT NEW.chat_id
+BEGIN
+    INSERT INTO user_changes (user_id, banned, notifications, chat_id)
+    VALUES (NEW.user_id, NEW.banned, NEW.notifications, NEW.chat_id);
+END;
+
+-- Индекс подписчиков: кому отправлять уведомления по каждой группе.
+-- grp = '' - пользователь без поля groups, он подписан на первый источник
+CREATE TABLE IF NOT EXISTS subscriptions (
+    user_id TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, grp)
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_grp ON subscriptions(grp);
+CREATE TRIGGER IF NOT EXISTS users_subscriptions_insert AFTER INSERT ON users BEGIN
+    INSERT OR IGNORE INTO subscriptions (user_id, grp, chat_id)
+""" + _SUBSCRIPTIONS_SELECT.format(user='NEW') + """;
+END;
+CREATE TRIGGER IF NOT EXISTS users_subscriptions_update AFTER UPDATE ON users
+WHEN OLD.banned IS NOT NEW.banned OR OLD.notifications IS NOT NEW.notifications
+    OR OLD.chat_id IS NOT NEW.chat_id
+    OR json_extract(OLD.data, '$.groups') IS NOT json_extract(NEW.data, '$.groups')
+BEGIN
+    DELETE FROM subscriptions WHERE user_id = OLD.user_id;
+    INSERT OR IGNORE INTO subscriptions (user_id, grp, chat_id)
+""" + _SUBSCRIPTIONS_SELECT.format(user='NEW') + """;
+END;
+CREATE TRIGGER IF NOT EXISTS users_subscriptions_delete AFTER DELETE ON users BEGIN
+    DELETE FROM subscriptions WHERE user_id = OLD.user_id;
+END;
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+def _connect(db_file):
+    connection = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return connection
+
+def get_connection(db_file=None):
+    """
+    Соединение с базой пользователей для текущего потока.
+    При первом обращении процесса создается схема и переносятся старые JSON-файлы.
+    """
+    db_file = db_file or DB_FILE
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    if db_file not in connections:
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        connection = _connect(db_file)
+        with _init_lock:
+            if db_file not in _initialized:
+                connection.executescript(SCHEMA)
+                _initialized.add(db_file)
+                migrate_from_json(os.path.dirname(db_file) or '.', connection)
+        connections[db_file] = connection
+    return connections[db_file]
+
+def default_user_data(user_id):
+    """Профиль нового пользователя"""
+    return {
+        'user_id': user_id,
+        'username': str(user_id),
+        'first_seen': datetime.now().isoformat(),
+        'last_seen': datetime.now().isoformat(),
+        'notifications': False,
+        'total_actions': 0,
+        'chat_id': None,
+        'banned': False,
+        'ban_reason': None
+    }
+
+def _row_values(user_id, data):
+    """Значения строки таблицы: индексируемые поля дублируются из JSON"""
+    return (
+        str(user_id),
+        1 if data.get('banned') else 0,
+        1 if data.get('notifications') else 0,
+        data.get('chat_id'),
+        json.dumps(data, ensure_ascii=False)
+    )
+
+def _write(connection, user_id, data):
+    connection.execute(
+        "INSERT INTO users (user_id, banned, notifications, chat_id, data) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET banned = excluded.banned, "
+        "notifications = excluded.notifications, chat_id = excluded.chat_id, data = excluded.data",
+        _row_values(user_id, data)
+    )
+
+def _read(connection, user_id):
+    row = connection.execute("SELECT data FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def load_user_data(user_id):
+    """Загружает данные пользователя; None, если пользователя нет"""
+    return _read(get_connection(), user_id)
+
+def save_user_data(user_id, data):
+    """Сохраняет данные пользователя целиком"""
+    _write(get_connection(), user_id, data)
+    _flags_changed(user_id, data)
+
+def modify_user_data(user_id, mutate, create=True):
+    """
+    Атомарно изменяет данные пользователя: mutate(data) вызывается внутри
+    транзакции BEGIN IMMEDIATE, поэтому параллельные изменения из бота
+    и админ-панели не затирают друг друга.
+    Возвращает новые данные или None, если пользователя нет и create=False.
+    """
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        data = _read(connection, user_id)
+        if data is None:
+            if not create:
+                connection.execute("ROLLBACK")
+                return None
+            data = default_user_data(user_id)
+        mutate(data)
+        _write(connection, user_id, data)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    _flags_changed(user_id, data)
+    return data
+
+def modify_many_user_data(mutations, within_transaction=None):
+    """
+    Применяет {user_id: mutate} одной транзакцией; отсутствующие пользователи создаются.
+    Используется для пакетной записи, когда отдельная транзакция на каждого слишком дорога.
+    within_transaction(connection) выполняется в той же транзакции.
+    """
+    connection = get_connection()
+    written = []
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for user_id, mutate in mutations.items():
+            data = _read(connection, user_id)
+            if data is None:
+                data = default_user_data(user_id)
+            mutate(data)
+            _write(connection, user_id, data)
+            written.append((user_id, data))
+        if within_transaction:
+            within_transaction(connection)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    for user_id, data in written:
+        _flags_changed(user_id, data)
+
+def update_user_data(user_id, new_data):
+    """Обновляет данные пользователя с гарантированным сохранением идентификаторов"""
+    def merge(current_data):
+        # Обновление данных с сохранением критичных полей
+        for key, value in new_data.items():
+            # Особые правила для ключевых полей
+            if key == 'chat_id' and value is not None:
+                current_data[key] = value
+            elif key == 'user_id':
+                continue  # Никогда не перезаписываем user_id из new_data
+            else:
+                current_data[key] = value
+        # Гарантируем что user_id всегда правильный
+        current_data['user_id'] = user_id
+
+    try:
+        return modify_user_data(user_id, merge)
+    except Exception as e:
+        logger.error(f"Ошибка обновления данных пользователя {user_id}: {str(e)}")
+        return None
+
+def iter_users(banned=None, notifications=None, with_chat=False):
+    """
+    Перебирает пользователей (user_id, данные) пачками по ITER_BATCH.
+    Фильтры banned, notifications и with_chat выполняются по индексам.
+    Курсор между пачками не держится, поэтому во время перебора можно изменять пользователей.
+    """
+    conditions = []
+    params = []
+    if banned is not None:
+        conditions.append("banned = ?")
+        params.append(1 if banned else 0)
+    if notifications is not None:
+        conditions.append("notifications = ?")
+        params.append(1 if notifications else 0)
+    if with_chat:
+        conditions.append("chat_id IS NOT NULL")
+
+    connection = get_connection()
+    last_id = ''
+    while True:
+        rows = connection.execute(
+            "SELECT user_id, data FROM users WHERE " + " AND ".join(conditions + ["user_id > ?"]) +
+            " ORDER BY user_id LIMIT ?",
+            params + [last_id, ITER_BATCH]
+        ).fetchall()
+        for user_id, data in rows:
+            yield user_id, json.loads(data)
+        if len(rows) < ITER_BATCH:
+            return
+        last_id = rows[-1][0]
+
+def count_users():
+    """Число пользователей"""
+    return get_connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+def iter_subscribers(group=None, default_group=None):
+    """
+    Подписчики с включенными уведомлениями [(user_id, chat_id)] по индексу subscriptions,
+    без чтения профилей. Без group - все подписчики; default_group - имя первого источника,
+    на который подписаны пользователи без поля groups.
+    """
+    connection = get_connection()
+    if group is None:
+        return connection.execute("SELECT DISTINCT user_id, chat_id FROM subscriptions").fetchall()
+    return connection.execute(
+        "SELECT user_id, chat_id FROM subscriptions WHERE grp = ? OR (grp = '' AND ? = ?)",
+        (group, group, default_group)
+    ).fetchall()
+
+def _expected_subscriptions():
+    """Подписки, вычисленные по таблице users - источнику истины для индекса"""
+    return _SUBSCRIPTIONS_SELECT.replace('FROM (SELECT 1) LEFT JOIN', 'FROM users AS u LEFT JOIN').format(user='u')
+
+def check_subscriptions(rebuild=True):
+    """
+    Сверяет индекс подписчиков с профилями и при расхождении пересобирает его.
+    Возвращает число расхождений.
+    """
+    connection = get_connection()
+    expected = _expected_subscriptions()
+    actual = "SELECT user_id, grp, chat_id FROM subscriptions"
+    mismatches = connection.execute(
+        f"SELECT (SELECT COUNT(*) FROM ({expected} EXCEPT {actual})) + "
+        f"(SELECT COUNT(*) FROM ({actual} EXCEPT {expected}))"
+    ).fetchone()[0]
+    if mismatches and rebuild:
+        logger.warning(f"Индекс подписчиков расходится с профилями ({mismatches}), пересборка")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM subscriptions")
+            connection.execute(f"INSERT OR IGNORE INTO subscriptions (user_id, grp, chat_id) {expected}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    return mismatches
+
+class UserFlags:
+    """
+    Кеш флагов пользователей (banned, notifications, chat_id) в памяти процесса.
+    Загружается из базы целиком один раз, записи этого процесса попадают в него сразу,
+    а изменения из других процессов (например, бан из админ-панели) подтягиваются
+    из таблицы user_changes вызовом refresh. Чтение кеша (get, is_banned) не обращается
+    к базе, поэтому refresh нужно вызывать в фоне раз в refresh_interval секунд.
+    """
+
+    def __init__(self, refresh_interval=DEFAULT_FLAGS_REFRESH):
+        self.refresh_interval = refresh_interval
+        self.flags = {}  # {user_id: (banned, notifications, chat_id)}
+        self.last_seq = None
+        self.pruned_seq = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Полная загрузка флагов всех пользователей"""
+        connection = get_connection()
+        with self.lock:
+            connection.execute("BEGIN")
+            try:
+                last_seq = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes").fetchone()[0]
+                flags = {
+                    user_id: (bool(banned), bool(notifications), chat_id)
+                    for user_id, banned, notifications, chat_id in connection.execute(
+                        "SELECT user_id, banned, notifications, chat_id FROM users")
+                }
+            finally:
+                connection.execute("COMMIT")
+            self.flags = flags
+            self.last_seq = last_seq
+
+    def refresh(self):
+        """Применяет изменения из user_changes и удаляет из журнала старые записи"""
+        if self.last_seq is None:
+            self.load()
+            return
+
+        connection = get_connection()
+        with self.lock:
+            rows = connection.execute(
+                "SELECT seq, user_id, banned, notifications, chat_id FROM user_changes WHERE seq > ? ORDER BY seq",
+                (self.last_seq,)
+            ).fetchall()
+            gap = bool(rows) and rows[0][0] != self.last_seq + 1
+            if not gap:
+                for seq, user_id, banned, notifications, chat_id in rows:
+                    self.flags[user_id] = (bool(banned), bool(notifications), chat_id)
+                    self.last_seq = seq
+
+            # Очистка журнала - запись, поэтому только когда появились новые старые строки
+            prune_seq = self.last_seq - MAX_FLAG_CHANGES
+            if prune_seq > self.pruned_seq:
+                try:
+                    connection.execute("DELETE FROM user_changes WHERE seq <= ?", (prune_seq,))
+                    self.pruned_seq = prune_seq
+                except sqlite3.OperationalError as e:
+                    logger.warning(f"Не удалось очистить журнал изменений флагов: {e}")
+
+        if gap:
+            # Нужные изменения уже удалены из журнала - перечитываем все
+            self.load()
+
+    def update(self, user_id, data):
+        """Обновление из пути записи этого процесса"""
+        with self.lock:
+            self.flags[str(user_id)] = (
+                bool(data.get('banned')), bool(data.get('notifications')), data.get('chat_id'))
+
+    def get(self, user_id):
+        """(banned, notifications, chat_id) или None, если пользователя нет; только чтение из памяти"""
+        return self.flags.get(str(user_id))
+
+    def is_banned(self, user_id):
+        flags = self.get(user_id)
+        return flags[0] if flags else False
+
+_user_flags = None
+
+def get_user_flags():
+    """Кеш флагов пользователей процесса"""
+    global _user_flags
+    if _user_flags is None:
+        _user_flags = UserFlags()
+    return _user_flags
+
+def _flags_changed(user_id, data):
+    if _user_flags is not None:
+        _user_flags.update(user_id, data)
+
+def migrate_from_json(users_dir=USERS_DIR, connection=None):
+    """
+    Переносит users/<id>.json в базу пачками по MIGRATION_BATCH, не загружая весь каталог в память.
+    Уже существующие в базе пользователи не перезаписываются.
+    Перенесенные файлы перекладываются в MIGRATED_DIR. Возвращает (перенесено, пропущено).
+    """
+    connection = connection or get_connection(os.path.join(users_dir, os.path.basename(DB_FILE)))
+    migrated_dir = os.path.join(users_dir, os.path.basename(MIGRATED_DIR))
+    moved = 0
+    skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal moved
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO users (user_id, banned, notifications, chat_id, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [_row_values(user_id, data) for user_id, data, _ in batch]
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        os.makedirs(migrated_dir, exist_ok=True)
+        for _, _, path in batch:
+            try:
+                os.replace(path, os.path.join(migrated_dir, os.path.basename(path)))
+            except OSError as e:
+                logger.error(f"Не удалось переместить {path}: {e}")
+        moved += len(batch)
+        batch.clear()
+
+    try:
+        entries = os.scandir(users_dir)
+    except FileNotFoundError:
+        return 0, 0
+    with entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось прочитать {entry.path}: {e}")
+                skipped += 1
+                continue
+            batch.append((entry.name[:-len('.json')], data, entry.path))
+            if len(batch) >= MIGRATION_BATCH:
+                flush()
+    if batch:
+        flush()
+
+    if moved or skipped:
+        logger.info(f"Миграция пользователей в базу: перенесено {moved}, с ошибками {skipped}")
+    return moved, skipped
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != 'migrate':
+        print("Использование: python user_repository.py migrate")
+        sys.exit(1)
+    os.makedirs(USERS_DIR, exist_ok=True)
+    connection = _connect(DB_FILE)
+    connection.executescript(SCHEMA)
+    moved, skipped = migrate_from_json(USERS_DIR, connection)
+    total = connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    print(f"Перенесено {moved}, с ошибками {skipped}, всего пользователей в базе: {total}")